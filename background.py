@@ -0,0 +1,107 @@
+from os import path, makedirs, replace, getpid
+import numpy as np
+import cv2 as cv
+import hashlib
+
+# Bumped when the way backgrounds are computed changes, so cached ones are computed again
+BACKGROUND_VERSION = 2
+
+def _median(frames):
+    # Per pixel median kept in uint8, np.median would go through float64
+    stack = np.stack(frames)
+    middle = (len(frames) - 1) // 2
+
+    return np.partition(stack, middle, axis=0)[middle]
+
+def medianBackground(video, samples=45):
+    # Per pixel temporal median of frames spread over the whole video, the
+    # animal is left out wherever it covers a pixel in less than half of them
+    cap = cv.VideoCapture(video)
+
+    if(not cap.isOpened()):
+        return None
+
+    num_frames = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    positions = np.unique(np.linspace(0, max(num_frames - 1, 0), samples).astype(int))
+
+    frames = []
+
+    for position in positions:
+        cap.set(cv.CAP_PROP_POS_FRAMES, int(position))
+        ret, frame = cap.read()
+
+        if(ret):
+            frames.append(frame)
+
+    cap.release()
+
+    if(len(frames) == 0):
+        return None
+
+    return _median(frames)
+
+def videoKey(video, chunk_size=1 << 20):
+    # Fingerprint of the video content from its size and a few chunks,
+    # hashing a multi-hour recording entirely would take longer than the median
+    size = path.getsize(video)
+    digest = hashlib.sha1(str(size).encode())
+
+    with open(video, 'rb') as file:
+        for offset in (0, size // 2, max(size - chunk_size, 0)):
+            file.seek(offset)
+            digest.update(file.read(chunk_size))
+
+    return digest.hexdigest()
+
+def cachedBackground(video, samples=45, cache_dir='./logs/backgrounds'):
+    cache_file = path.join(cache_dir, f'{videoKey(video)}_{samples}_v{BACKGROUND_VERSION}.png')
+
+    if(path.isfile(cache_file)):
+        bg_img = cv.imread(cache_file)
+
+        if(bg_img is not None):
+            return bg_img
+
+    bg_img = medianBackground(video, samples)
+
+    if(bg_img is None):
+        return None
+
+    makedirs(cache_dir, exist_ok=True)
+
+    # Written aside and renamed, other processes may be reading it
+    temp_file = path.join(cache_dir, f'{getpid()}.tmp.png')
+    cv.imwrite(temp_file, bg_img)
+    replace(temp_file, cache_file)
+
+    return bg_img
+
+class RunningBackground:
+    # Slowly updating average of the scene to follow lighting drift. The
+    # pixels under the detection are left out so the animal does not fade
+    # into the background while it stands still.
+
+    def __init__(self, bg_img, alpha=0.002, every=1):
+        self.alpha = alpha
+        self.every = every
+        self.frames = 0
+
+        self.average = bg_img.astype(np.float32)
+        self.bg_img = bg_img.copy()
+        self.update_mask = np.empty(bg_img.shape[:2], dtype=np.uint8)
+
+    def update(self, frame, mask=None):
+        self.frames += 1
+
+        if(self.frames % self.every != 0):
+            return self.bg_img
+
+        if(mask is None):
+            cv.accumulateWeighted(frame, self.average, self.alpha)
+        else:
+            cv.bitwise_not(mask, dst=self.update_mask)
+            cv.accumulateWeighted(frame, self.average, self.alpha, mask=self.update_mask)
+
+        cv.convertScaleAbs(self.average, dst=self.bg_img)
+
+        return self.bg_img
@@ -0,0 +1,161 @@
+from tracker import parser_args as tracker_args, trackVideo
+from multiprocessing import Pool
+from os import path, listdir, cpu_count, replace
+from time import perf_counter
+import cv2 as cv
+import argparse
+import json
+import csv
+
+VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mov', '.mkv', '.mpg', '.mpeg', '.h264')
+
+def parser_args():
+    parser = argparse.ArgumentParser(
+        description='Tracks mice on every video of a directory or manifest.'
+    )
+
+    parser.add_argument(
+        'source', type=str,
+        help='Directory with the videos or a CSV manifest with the columns\
+        video, frame_rate, lower_boundary, upper_boundary, rois and background.'
+    )
+
+    parser.add_argument(
+        '--frame-rate', type=int, default=30,
+        help='Frame rate of the videos not given by the manifest.'
+    )
+
+    parser.add_argument(
+        '--lower-boundary', type=int, default=100,
+        help='Lower boundary of the mice color not given by the manifest.'
+    )
+
+    parser.add_argument(
+        '--upper-boundary', type=int, default=160,
+        help='Upper boundary of the mice color not given by the manifest.'
+    )
+
+    parser.add_argument(
+        '--rois', type=str, default='',
+        help='Regions of interest as "x,y,w,h;x,y,w,h" for the videos not given by the manifest.'
+    )
+
+    parser.add_argument(
+        '--background', type=str, default='first', choices=['first', 'median'],
+        help='Background of the videos not given by the manifest, see tracker.py.'
+    )
+
+    parser.add_argument(
+        '--processes', type=int, default=0,
+        help='Number of videos processed at the same time, 0 uses every core.'
+    )
+
+    parser.add_argument(
+        '--status-file', type=str, default=None,
+        help='Where the state of each video is kept, defaults to <source>_status.json.'
+    )
+
+    parser.add_argument(
+        '--retry-failed', action='store_true',
+        help='Processes again the videos that failed on a previous run.'
+    )
+
+    return parser.parse_args()
+
+def loadJobs(args):
+    defaults = {
+        'frame_rate': args.frame_rate,
+        'lower_boundary': args.lower_boundary,
+        'upper_boundary': args.upper_boundary,
+        'rois': args.rois,
+        'background': args.background
+    }
+
+    if(path.isdir(args.source)):
+        return [
+            dict(defaults, video=path.join(args.source, file_name))
+            for file_name in sorted(listdir(args.source))
+            if file_name.lower().endswith(VIDEO_EXTENSIONS)
+        ]
+
+    jobs = []
+    with open(args.source, 'r', newline='') as manifest:
+        for row in csv.DictReader(manifest):
+            job = dict(defaults)
+
+            # Empty cells fall back to the command line values
+            job.update({ key: value for key, value in row.items() if value not in (None, '') })
+            jobs.append(job)
+
+    return jobs
+
+def loadStatus(status_file):
+    if(not path.isfile(status_file)):
+        return {}
+
+    with open(status_file, 'r') as file:
+        return json.load(file)
+
+def saveStatus(status_file, status):
+    # Written aside and renamed so an interruption never leaves it half written
+    with open(status_file + '.tmp', 'w') as file:
+        json.dump(status, file, indent=2)
+
+    replace(status_file + '.tmp', status_file)
+
+def jobArgv(job):
+    argv = [
+        job['video'], str(job['frame_rate']),
+        '--headless', '--no-progress',
+        '--log-position', '--log-speed', '--log-stats',
+        '--lower-boundary', str(job['lower_boundary']),
+        '--upper-boundary', str(job['upper_boundary']),
+        '--background', job['background']
+    ]
+
+    if(job['rois']):
+        argv += ['--rois', job['rois']]
+
+    return argv
+
+def _initWorker():
+    # Each process already owns a core
+    cv.setNumThreads(1)
+
+def _runJob(job):
+    start_time = perf_counter()
+    error = None
+
+    try:
+        status = 'done' if trackVideo(tracker_args(jobArgv(job))) else 'failed'
+    except Exception as e:
+        status, error = 'failed', repr(e)
+
+    return job['video'], status, perf_counter() - start_time, error
+
+if __name__ == '__main__':
+    args = parser_args()
+
+    status_file = args.status_file or f'{path.normpath(args.source)}_status.json'
+    status = loadStatus(status_file)
+
+    # Skips what a previous run already finished
+    skip = ('done', 'failed') if not args.retry_failed else ('done', )
+    jobs = [
+        job for job in loadJobs(args)
+        if status.get(job['video'], {}).get('status') not in skip
+    ]
+
+    print(f'{len(jobs)} videos to process, status kept in {status_file}')
+
+    processes = args.processes if args.processes > 0 else cpu_count()
+
+    with Pool(min(processes, max(len(jobs), 1)), initializer=_initWorker) as pool:
+        for video, video_status, elapsed, error in pool.imap_unordered(_runJob, jobs):
+            status[video] = { 'status': video_status, 'elapsed': round(elapsed, 3) }
+
+            if(error is not None):
+                status[video]['error'] = error
+
+            saveStatus(status_file, status)
+            print(f'[{video_status}] {video} ({elapsed:.1f}s)')
@@ -0,0 +1,342 @@
+from tracker import detect, makeFinder
+from segmentation import Segmenter, CHANNEL_MODES, MORPHOLOGY_MODES, DETECTORS
+from profiling import StageTimer, NULL_TIMER
+from os import path, makedirs, replace, getpid
+from time import perf_counter
+import numpy as np
+import cv2 as cv
+import tracemalloc
+import argparse
+import json
+import sys
+
+try:
+    import resource
+except ImportError:
+    # Only on Unix, the resident memory is left out elsewhere
+    resource = None
+
+# Bumped when the synthetic videos change, so cached ones are generated again
+SYNTHETIC_VERSION = 1
+
+def parser_args():
+    parser = argparse.ArgumentParser(
+        description='Measures the tracking pipeline on synthetic videos.'
+    )
+
+    parser.add_argument(
+        '--resolutions', type=str, default='640x480,1280x720,1920x1080',
+        help='Comma separated WIDTHxHEIGHT of the synthetic videos.'
+    )
+
+    parser.add_argument(
+        '--lengths', type=str, default='100,400',
+        help='Comma separated number of frames of the synthetic videos.'
+    )
+
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed of the synthetic videos, the same seed gives the same videos.'
+    )
+
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='Runs of each video, the fastest one is kept.'
+    )
+
+    parser.add_argument(
+        '--channels', type=str, default='bgr', choices=CHANNEL_MODES,
+        help='Channels compared with the background, see tracker.py.'
+    )
+
+    parser.add_argument(
+        '--morphology', type=str, default='ellipse', choices=MORPHOLOGY_MODES,
+        help='How the opening is computed, see tracker.py.'
+    )
+
+    parser.add_argument(
+        '--detectors', type=str, default='contours',
+        help=f'Comma separated ways the detections are found in the mask, each video is run with every one of them ({", ".join(DETECTORS)}), see tracker.py.'
+    )
+
+    parser.add_argument(
+        '--clutter', type=str, default='0',
+        help='Comma separated number of bright specks added to each frame, as left by bedding or reflections, 0 for clean videos.'
+    )
+
+    parser.add_argument(
+        '--search-window', type=int, default=0,
+        help='Segments only a window of this size around the last detection, see tracker.py.'
+    )
+
+    parser.add_argument(
+        '--pyramid-scale', type=float, default=1.0,
+        help='Finds the animal at this downscale, see tracker.py.'
+    )
+
+    parser.add_argument(
+        '--video-dir', type=str, default='./logs/benchmark',
+        help='Where the synthetic videos are kept between runs.'
+    )
+
+    parser.add_argument(
+        '--output', type=str, default='./logs/benchmark/results.json',
+        help='File the results are written to.'
+    )
+
+    parser.add_argument(
+        '--compare', type=str, default=None,
+        help='Results of a previous run, fails when a stage is slower than in them.'
+    )
+
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='Relative slowdown of a stage counted as a regression.'
+    )
+
+    parser.add_argument(
+        '--min-difference', type=float, default=0.05,
+        help='Slowdowns under this many milliseconds per frame are taken as noise.'
+    )
+
+    return parser.parse_args()
+
+def mousePose(index, num_frames, width, height):
+    # Centre and heading of the synthetic mouse, a Lissajous path over the arena
+    t = 2 * np.pi * index / max(num_frames, 1)
+
+    x = width / 2 + 0.35 * width * np.sin(t)
+    y = height / 2 + 0.35 * height * np.sin(2 * t + np.pi / 3)
+
+    # Heading along the path
+    dx = 0.35 * width * np.cos(t)
+    dy = 0.7 * height * np.cos(2 * t + np.pi / 3)
+
+    return x, y, np.degrees(np.arctan2(dy, dx))
+
+def syntheticBackground(rng, width, height):
+    # Smooth texture of dark greys, the mouse is about 130 levels brighter
+    coarse = rng.uniform(50, 80, size=(max(height // 32, 2), max(width // 32, 2), 3))
+    texture = cv.resize(coarse, (width, height), interpolation=cv.INTER_CUBIC)
+    texture += rng.normal(0, 2, size=texture.shape)
+
+    return np.clip(texture, 0, 255).astype(np.uint8)
+
+def addClutter(rng, frame, count):
+    # Specks of 4x4 pixels, large enough to survive the opening of the tracker
+    height, width = frame.shape[:2]
+
+    xs = rng.integers(0, width - 4, size=count)
+    ys = rng.integers(0, height - 4, size=count)
+
+    for x, y in zip(xs, ys):
+        frame[y:y+4, x:x+4] = 200
+
+def syntheticVideo(video_dir, width, height, num_frames, seed, clutter=0):
+    suffix = f'_c{clutter}' if clutter > 0 else ''
+    file_name = path.join(
+        video_dir, f'synthetic_v{SYNTHETIC_VERSION}_{width}x{height}_{num_frames}_{seed}{suffix}.avi'
+    )
+
+    if(path.isfile(file_name)):
+        return file_name
+
+    makedirs(video_dir, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    background = syntheticBackground(rng, width, height)
+
+    axes = (max(int(0.03 * width), 2), max(int(0.012 * width), 1))
+    frame = np.empty_like(background)
+    noise = np.empty(background.shape, dtype=np.int16)
+
+    # Written aside and renamed, an interrupted run leaves no partial video
+    temp_file = path.join(video_dir, f'{getpid()}.tmp.avi')
+    writer = cv.VideoWriter(temp_file, cv.VideoWriter_fourcc('M', 'J', 'P', 'G'), 30, (width, height))
+
+    # The first frame is the empty arena, used as background by the tracker
+    for index in range(num_frames + 1):
+        np.copyto(frame, background)
+
+        if(index > 0):
+            x, y, angle = mousePose(index, num_frames, width, height)
+            cv.ellipse(frame, (int(x), int(y)), axes, angle, 0, 360, (200, 200, 200), -1, cv.LINE_AA)
+            addClutter(rng, frame, clutter)
+
+        # Sensor noise
+        noise[...] = rng.normal(0, 3, size=noise.shape)
+        cv.add(frame, noise, dst=frame, dtype=cv.CV_8U)
+
+        writer.write(frame)
+
+    writer.release()
+    replace(temp_file, file_name)
+
+    return file_name
+
+def trackSynthetic(video, num_frames, detector, args, timer=NULL_TIMER):
+    cap = cv.VideoCapture(video)
+    width, height = int(cap.get(3)), int(cap.get(4))
+
+    ret, bg_img = cap.read()
+
+    if(not ret):
+        raise RuntimeError(f'Could not read {video}')
+
+    segmenter = Segmenter(
+        bg_img, [100] * 3, [160] * 3,
+        channels=args.channels, morphology=args.morphology, detector=detector
+    )
+    segmenter.timer = timer
+
+    finder = makeFinder(segmenter, args.search_window, args.pyramid_scale)
+
+    frames = 0
+    detected = 0
+    errors = []
+
+    while(True):
+        began = timer.now()
+        ret, frame = cap.read()
+
+        if(not ret):
+            break
+
+        timer.start(began)
+        timer.mark('decode')
+
+        frames += 1
+        _, orientation, _ = detect(segmenter, frame, finder, with_contour=False)
+
+        if(orientation is not None):
+            detected += 1
+
+            x, y, _ = mousePose(frames, num_frames, width, height)
+            errors.append(np.hypot(orientation[0][0] - x, orientation[0][1] - y))
+
+    cap.release()
+
+    return frames, detected, errors
+
+def runCase(video, num_frames, detector, args):
+    timer = StageTimer()
+
+    start_time = perf_counter()
+    frames, detected, errors = trackSynthetic(video, num_frames, detector, args, timer)
+    elapsed = perf_counter() - start_time
+
+    frames = max(frames, 1)
+
+    return {
+        'frames': frames,
+        'fps': frames / elapsed,
+        'ms_per_frame': 1000 * elapsed / frames,
+        'stages': { stage: 1000 * total / frames for stage, total in timer.totals.items() },
+        'detected': detected / frames,
+        'centroid_error': float(np.mean(errors)) if len(errors) > 0 else None
+    }
+
+def peakMemory(video, num_frames, detector, args):
+    # In a pass of its own, tracing the allocations slows down every stage
+    tracemalloc.start()
+    trackSynthetic(video, num_frames, detector, args)
+
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak_memory / 2**20
+
+def compareResults(baseline, results, threshold, min_difference):
+    # Slower stages of the cases present in both runs
+    regressions = []
+
+    for case, result in results['cases'].items():
+        if(case not in baseline['cases']):
+            continue
+
+        previous = baseline['cases'][case]
+
+        timings = dict(result['stages'], total=result['ms_per_frame'])
+        previous_timings = dict(previous['stages'], total=previous['ms_per_frame'])
+
+        for stage, value in timings.items():
+            if(stage not in previous_timings):
+                continue
+
+            before = previous_timings[stage]
+
+            if(value - before > min_difference and value > before * (1 + threshold)):
+                regressions.append((case, stage, before, value))
+
+    return regressions
+
+if __name__ == '__main__':
+    args = parser_args()
+
+    resolutions = [ tuple(map(int, r.split('x'))) for r in args.resolutions.split(',') ]
+    lengths = [ int(length) for length in args.lengths.split(',') ]
+    clutters = [ int(clutter) for clutter in args.clutter.split(',') ]
+    detectors = args.detectors.split(',')
+
+    for detector in detectors:
+        if(detector not in DETECTORS):
+            sys.exit(f'Unknown detector: {detector}')
+
+    results = {
+        'settings': {
+            key: getattr(args, key)
+            for key in ('seed', 'repeat', 'channels', 'morphology', 'search_window', 'pyramid_scale')
+        },
+        'opencv': cv.__version__,
+        'cases': {}
+    }
+
+    for width, height in resolutions:
+        for num_frames in lengths:
+            for clutter in clutters:
+                video = syntheticVideo(args.video_dir, width, height, num_frames, args.seed, clutter)
+
+                for detector in detectors:
+                    # Clean videos traced with contours keep the names of earlier results
+                    case = f'{width}x{height}x{num_frames}'
+                    if(clutter > 0):
+                        case += f'_c{clutter}'
+                    if(detector != 'contours'):
+                        case += f'_{detector}'
+
+                    # The fastest run is the one least disturbed by the rest of the system
+                    runs = [ runCase(video, num_frames, detector, args) for _ in range(max(args.repeat, 1)) ]
+                    result = min(runs, key=lambda run: run['ms_per_frame'])
+                    result['peak_memory_mb'] = peakMemory(video, num_frames, detector, args)
+
+                    results['cases'][case] = result
+
+                    stages = ', '.join(f'{stage} {ms:.3f}' for stage, ms in result['stages'].items())
+                    print(f'{case}: {result["fps"]:.1f} fps, {result["ms_per_frame"]:.3f} ms/frame ({stages})')
+
+    # Peak resident memory of the whole process, in kilobytes on Linux
+    if(resource is not None):
+        results['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    makedirs(path.dirname(path.abspath(args.output)), exist_ok=True)
+
+    with open(args.output + '.tmp', 'w') as file:
+        json.dump(results, file, indent=2)
+
+    replace(args.output + '.tmp', args.output)
+
+    print(f'Results written to {args.output}')
+
+    if(args.compare is not None):
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+
+        regressions = compareResults(baseline, results, args.threshold, args.min_difference)
+
+        for case, stage, before, after in regressions:
+            print(f'Regression in {case} {stage}: {before:.3f} -> {after:.3f} ms/frame')
+
+        if(len(regressions) > 0):
+            sys.exit(1)
+
+        print(f'No stage is more than {args.threshold:.0%} slower than in {args.compare}')
@@ -0,0 +1,145 @@
+from segmentation import Segmenter, MORPHOLOGY_MODES, CHANNEL_MODES
+from background import cachedBackground
+from time import perf_counter
+import numpy as np
+import cv2 as cv
+import argparse
+
+def parser_args():
+    parser = argparse.ArgumentParser(
+        description='Compares the cost and the masks of the morphology options on a video.'
+    )
+
+    parser.add_argument(
+        'video', type=str,
+        help='Path to the video file used for the comparison.'
+    )
+
+    parser.add_argument(
+        '--frames', type=int, default=300,
+        help='Number of frames compared, 0 compares the whole video.'
+    )
+
+    parser.add_argument(
+        '--erode-size', type=int, default=3,
+        help='Size of the erosion kernel.'
+    )
+
+    parser.add_argument(
+        '--dilate-size', type=int, default=20,
+        help='Size of the dilation kernel.'
+    )
+
+    parser.add_argument(
+        '--lower-boundary', type=int, default=100,
+        help='Lower boundary of the mice color in the subtracted image.'
+    )
+
+    parser.add_argument(
+        '--upper-boundary', type=int, default=160,
+        help='Upper boundary of the mice color in the subtracted image.'
+    )
+
+    parser.add_argument(
+        '--channels', type=str, default='bgr', choices=CHANNEL_MODES,
+        help='Channels compared with the background, see tracker.py.'
+    )
+
+    parser.add_argument(
+        '--blur', action='store_true',
+        help='Blurs the subtracted image as trackerArduino.py does.'
+    )
+
+    parser.add_argument(
+        '--median-bg', action='store_true',
+        help='Uses the median of frames spread over the video as background instead of the first frame.'
+    )
+
+    return parser.parse_args()
+
+def iou(reference, mask):
+    union = np.count_nonzero(reference | mask)
+
+    # Two empty masks are the same
+    if(union == 0):
+        return 1.0
+
+    return np.count_nonzero(reference & mask) / union
+
+if __name__ == '__main__':
+    args = parser_args()
+
+    cap = cv.VideoCapture(args.video)
+
+    if(not cap.isOpened()):
+        print('Error opening video stream')
+        exit()
+
+    # First frame as the background image
+    ret, bg_img = cap.read()
+
+    if(not ret):
+        print('Error readning video stream')
+        exit()
+
+    if(args.median_bg):
+        median_bg = cachedBackground(args.video)
+
+        if(median_bg is not None):
+            bg_img = median_bg
+
+    lower_white = np.array([args.lower_boundary] * 3)
+    upper_white = np.array([args.upper_boundary] * 3)
+
+    # The first option is the reference the others are compared with
+    segmenters = {
+        morphology: Segmenter(
+            bg_img, lower_white, upper_white,
+            erode_size=args.erode_size, dilate_size=args.dilate_size,
+            blur=args.blur, channels=args.channels, morphology=morphology
+        )
+        for morphology in MORPHOLOGY_MODES
+    }
+
+    elapsed = { morphology: 0.0 for morphology in MORPHOLOGY_MODES }
+    ious = { morphology: [] for morphology in MORPHOLOGY_MODES }
+    frames = 0
+
+    while(args.frames <= 0 or frames < args.frames):
+        ret, frame = cap.read()
+
+        if(not ret):
+            break
+
+        for morphology, segmenter in segmenters.items():
+            start_time = perf_counter()
+            segmenter.segment(frame)
+            elapsed[morphology] += perf_counter() - start_time
+
+        # Masks are kept by each segmenter until its next frame
+        reference = segmenters[MORPHOLOGY_MODES[0]].mask
+
+        for morphology, segmenter in segmenters.items():
+            ious[morphology].append(iou(reference, segmenter.mask))
+
+        frames += 1
+
+    cap.release()
+
+    if(frames == 0):
+        print('No frames were read')
+        exit()
+
+    reference_time = elapsed[MORPHOLOGY_MODES[0]]
+
+    print(f'{frames} frames, erode {args.erode_size}, dilate {args.dilate_size}')
+    print(f'{"morphology":<12}{"ms/frame":>10}{"speedup":>10}{"mean IoU":>10}{"min IoU":>10}')
+
+    for morphology in MORPHOLOGY_MODES:
+        print(
+            f'{morphology:<12}'
+            f'{1000 * elapsed[morphology] / frames:>10.3f}'
+            f'{reference_time / max(elapsed[morphology], 1e-9):>10.2f}'
+            f'{np.mean(ious[morphology]):>10.4f}'
+            f'{np.min(ious[morphology]):>10.4f}'
+        )
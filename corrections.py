@@ -0,0 +1,204 @@
+from os import fsync, path, remove, replace
+import pandas as pd
+import numpy as np
+import argparse
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Lists or merges the corrections made to a position log with detectionsAnalyser.py.'
+    )
+
+    parser.add_argument(
+        'log_file', type=str,
+        help='Path to the position log file.'
+    )
+
+    parser.add_argument(
+        '--compact', action='store_true',
+        help='Rewrites the log with its corrections and removes the journal.'
+    )
+
+    parser.add_argument(
+        '--chunk-size', type=int, default=1000000,
+        help='Rows of the log read at once.'
+    )
+
+    return parser.parse_args()
+
+def flipY(position, frame_height):
+    # Between image coordinates, y pointing down, and the coordinates of the
+    # position logs, y pointing up from the bottom left as exportCsv writes
+    # them. The conversion is its own inverse.
+    return position[0], frame_height - position[1]
+
+def journalPath(log_file):
+    return f'{path.splitext(log_file)[0]}_corrections.csv'
+
+class CorrectionJournal:
+    # Corrections of a log appended one per line as they are made and
+    # forced to the disk, so a crash loses at most the one being written.
+    # The log itself is only rewritten when the journal is compacted.
+
+    def __init__(self, log_file):
+        self.file_path = journalPath(log_file)
+
+        new = not path.isfile(self.file_path) or path.getsize(self.file_path) == 0
+
+        # A line cut short by a crash is ended before appending to it
+        cut = False
+        if(not new):
+            with open(self.file_path, 'rb') as file:
+                file.seek(-1, 2)
+                cut = file.read(1) != b'\n'
+
+        self.file = open(self.file_path, 'a')
+
+        if(new):
+            self.file.write('frame,x,y\n')
+        elif(cut):
+            self.file.write('\n')
+
+    def append(self, frame, x, y):
+        self.file.write(f'{frame},{x},{y}\n')
+        self.file.flush()
+        fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def readCorrections(log_file):
+    # Corrected position of each frame, the latest correction wins
+    corrections = {}
+    file_path = journalPath(log_file)
+
+    if(not path.isfile(file_path)):
+        return corrections
+
+    with open(file_path, 'r') as file:
+        for line in file:
+            try:
+                frame, x, y = line.strip().split(',')
+                corrections[int(frame)] = (float(x), float(y))
+            except ValueError:
+                # The header, or a line cut short by a crash
+                continue
+
+    return corrections
+
+def applyCorrections(frames, x, y, corrected_frames, corrected_positions):
+    # Frames are in increasing order, as logged. Corrections of frames the
+    # log has no row for become new rows.
+    index = np.searchsorted(frames, corrected_frames)
+
+    found = index < len(frames)
+    found[found] = frames[index[found]] == corrected_frames[found]
+
+    x[index[found]] = corrected_positions[found, 0]
+    y[index[found]] = corrected_positions[found, 1]
+
+    if(not found.all()):
+        frames = np.concatenate((frames, corrected_frames[~found]))
+        x = np.concatenate((x, corrected_positions[~found, 0]))
+        y = np.concatenate((y, corrected_positions[~found, 1]))
+
+        order = np.argsort(frames, kind='stable')
+        frames, x, y = frames[order], x[order], y[order]
+
+    return frames, x, y
+
+def iterPositions(log_file, corrections=None, chunk_size=1000000):
+    # Frames and positions of the log in chunks with the corrections applied.
+    # The frame of each row is its frame column when there is one and its
+    # row number otherwise.
+    if(corrections is None):
+        corrections = readCorrections(log_file)
+
+    corrected_frames = np.array(sorted(corrections), dtype=np.int64)
+    corrected_positions = np.array(
+        [ corrections[frame] for frame in corrected_frames ], dtype=np.float64
+    ).reshape(-1, 2)
+
+    # Rows read so far and corrections already applied
+    offset = 0
+    applied = 0
+
+    for chunk in pd.read_csv(log_file, chunksize=chunk_size):
+        x = np.array(chunk['x'], dtype=np.float64)
+        y = np.array(chunk['y'], dtype=np.float64)
+
+        if('frame' in chunk.columns):
+            frames = np.array(chunk['frame'], dtype=np.int64)
+        else:
+            frames = np.arange(offset, offset + len(chunk), dtype=np.int64)
+
+        offset += len(chunk)
+
+        if(len(frames) == 0):
+            continue
+
+        # Corrections up to the last frame of this chunk
+        end = np.searchsorted(corrected_frames, frames[-1], side='right')
+
+        if(end > applied):
+            frames, x, y = applyCorrections(
+                frames, x, y,
+                corrected_frames[applied:end], corrected_positions[applied:end]
+            )
+            applied = end
+
+        yield frames, x, y
+
+    # Corrections past the end of the log
+    if(applied < len(corrected_frames)):
+        yield (
+            corrected_frames[applied:],
+            corrected_positions[applied:, 0].copy(),
+            corrected_positions[applied:, 1].copy()
+        )
+
+def loadPositions(log_file, chunk_size=1000000):
+    chunks = list(iterPositions(log_file, chunk_size=chunk_size))
+
+    if(len(chunks) == 0):
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+
+    frames, x, y = zip(*chunks)
+
+    return np.concatenate(frames), np.concatenate(x), np.concatenate(y)
+
+def compactLog(log_file, chunk_size=1000000):
+    # Rewrites the log with its corrections, as a frame indexed log
+    journal_file = journalPath(log_file)
+
+    if(not path.isfile(journal_file)):
+        return 0
+
+    corrections = readCorrections(log_file)
+
+    with open(log_file + '.tmp', 'w') as file:
+        file.write('frame,x,y\n')
+
+        for frames, x, y in iterPositions(log_file, corrections, chunk_size):
+            # Every digit kept, compacting must not round sub-pixel positions
+            np.savetxt(
+                file, np.column_stack((frames, x, y)),
+                fmt=('%d', '%.17g', '%.17g'), delimiter=','
+            )
+
+    replace(log_file + '.tmp', log_file)
+
+    # Applying the journal again to the compacted log changes nothing, so
+    # being stopped here is harmless
+    remove(journal_file)
+
+    return len(corrections)
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if(args.compact):
+        count = compactLog(args.log_file, args.chunk_size)
+        print(f'{count} corrections merged into {args.log_file}')
+    else:
+        for frame, (x, y) in sorted(readCorrections(args.log_file).items()):
+            print(f'{frame}: {x:g}, {y:g}')
@@ -1,8 +1,13 @@
-from time import sleep
+from corrections import CorrectionJournal, loadPositions, applyCorrections, flipY
+from collections import OrderedDict
 import numpy as np
 import cv2 as cv
 import argparse
 
+# Reasons a frame is suspect, combined as bits
+ZERO, SPIKE, MISSING = 1, 2, 4
+REASONS = ((ZERO, 'zero'), (SPIKE, 'spike'), (MISSING, 'missing'))
+
 def parser_args():
     parser = argparse.ArgumentParser(
         description='Visualise and enables corrections on log files.'
@@ -18,34 +23,158 @@ def parser_args():
         help='Path to the log file.'
     )
 
+    parser.add_argument(
+        '--cache-mb', type=int, default=256,
+        help='Megabytes of decoded frames kept around the playhead.'
+    )
+
+    parser.add_argument(
+        '--image-coordinates', action='store_true',
+        help='The log holds image coordinates, y pointing down, instead of the bottom left origin of tracker.py logs.'
+    )
+
+    parser.add_argument(
+        '--spike-sigma', type=float, default=6.0,
+        help='Steps this many robust deviations above the median step are speed spikes.'
+    )
+
     return parser.parse_args()
 
-def fileGenerator(filePath):
-    with open(filePath, 'r')  as file:
-        file.readline()
-        for lineNum, line in enumerate(file):
-            yield lineNum + 1, line.rstrip().split(',')
+def frameRows(frames, size):
+    # Row of each frame in the log, -1 when it has none
+    rows = np.full(max(size, int(frames.max()) + 1 if len(frames) else 0), -1, dtype=np.int64)
+    rows[frames] = np.arange(len(frames))
+
+    return rows
+
+def findSuspects(frames, x, y, num_frames, spike_sigma):
+    # Reason bits of every frame of the video, computed at once from the log
+    reasons = np.zeros(max(num_frames, int(frames.max()) + 1 if len(frames) else 0), dtype=np.uint8)
+
+    # Rows without a detection
+    zero = (x == 0) | (y == 0) | np.isnan(x) | np.isnan(y)
+    reasons[frames[zero]] |= ZERO
+
+    # Jumps much larger than the usual step between consecutive detections
+    valid = ~zero
+    valid_frames = frames[valid]
+
+    if(len(valid_frames) > 2):
+        steps = np.hypot(np.diff(x[valid]), np.diff(y[valid])) / np.maximum(np.diff(valid_frames), 1)
+
+        median = np.median(steps)
+        deviation = 1.4826 * np.median(np.abs(steps - median))
+
+        spikes = steps > median + spike_sigma * max(deviation, 1.0)
+        reasons[valid_frames[1:][spikes]] |= SPIKE
+
+    # Frames of the video without a row
+    present = np.zeros(len(reasons), dtype=bool)
+    present[frames] = True
+    reasons[~present] |= MISSING
+
+    return reasons
+
+def describe(reason):
+    return ', '.join(name for bit, name in REASONS if reason & bit)
+
+class FrameCache:
+    # Decoded frames kept by index, the least recently used ones are dropped
+    # first. A miss decodes a run of frames around the requested one, so
+    # stepping back and forth near the playhead never seeks again. The
+    # number of frames follows from the memory allowed and the frame size.
 
-def editFrame(frame, lineNum, changes):
+    def __init__(self, cap, max_bytes=256 * 2**20):
+        self.cap = cap
+
+        frame_bytes = max(int(cap.get(3)) * int(cap.get(4)) * 3, 1)
+        self.size = max(max_bytes // frame_bytes, 4)
+
+        # A quarter of the cache on each side of a seek
+        self.behind = self.ahead = max(min(self.size // 4, 16), 1)
+
+        self.frames = OrderedDict()
+
+        # Index of the frame the decoder reads next
+        self.position = 0
+
+    def _decode(self, start, end):
+        if(start != self.position):
+            self.cap.set(cv.CAP_PROP_POS_FRAMES, start)
+            self.position = start
+
+        while(self.position < end):
+            ret, frame = self.cap.read()
+
+            if(not ret):
+                break
+
+            self._store(self.position, frame)
+            self.position += 1
+
+    def _store(self, index, frame):
+        self.frames[index] = frame
+        self.frames.move_to_end(index)
+
+        while(len(self.frames) > self.size):
+            self.frames.popitem(last=False)
+
+    def get(self, index):
+        if(index not in self.frames):
+            if(index == self.position):
+                # Playing forward, no seek
+                self._decode(index, index + self.ahead)
+            else:
+                self._decode(max(index - self.behind, 0), index + self.ahead)
+
+        frame = self.frames.get(index)
+
+        if(frame is not None):
+            self.frames.move_to_end(index)
+
+        return frame
+
+def editFrame(frame):
     print('\n>>> Drag the mouse to select, the disired centre should be in the crosshair.')
     x, y, w, h = cv.selectROI('Edition Window', frame, True)
 
     cv.destroyWindow('Edition Window')
 
-    # Store the changes made into the changes list
-    changes.append({
-        'line': lineNum,
-        'content': f'{x + w//2},{y + h//2}'
-    })
-    
-    
+    # Nothing selected
+    if(w == 0 or h == 0):
+        return None
+
+    return (x + w//2, y + h//2)
+
+def annotate(frame, frameIndex, position, reason, suspects):
+    annotatedFrame = frame.copy()
+
+    if(position is not None and position[0] != 0 and position[1] != 0):
+        cv.circle(
+            annotatedFrame,
+            (int(position[0]), int(position[1])),
+            5, (42, 89, 247), -1
+        )
+
+    text = f'Frame {frameIndex}, {suspects} suspect frames'
+    if(reason):
+        text += f' - {describe(reason)}'
+
+    cv.putText(
+        annotatedFrame, text, (10, 25),
+        cv.FONT_HERSHEY_COMPLEX, 0.6,
+        (80, 80, 255) if reason else (255, 255, 255)
+    )
+
+    return annotatedFrame
+
 if __name__ == '__main__':
     args = parser_args()
 
-    # Gerenator for the log file
-    file = fileGenerator(args.log_file)
-
-    if(not file):
+    try:
+        # Corrections of previous sessions included
+        frames, xs, ys = loadPositions(args.log_file)
+    except (OSError, ValueError, KeyError):
         print('Unable to open the log file.')
         exit()
 
@@ -55,76 +184,168 @@ if __name__ == '__main__':
         print('Error opening video stream.')
         exit()
 
-    # List to store the changes made in the log file
-    changes = []
+    num_frames = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    frame_rate = max(int(round(cap.get(cv.CAP_PROP_FPS))), 1)
+
+    # Positions are drawn and clicked in image coordinates and kept in the log's
+    frame_height = int(cap.get(4))
+
+    def toImage(position):
+        return position if args.image_coordinates else flipY(position, frame_height)
+
+    toLog = toImage
+
+    rows = frameRows(frames, num_frames)
+
+    reasons = findSuspects(frames, xs, ys, num_frames, args.spike_sigma)
+    suspects = np.flatnonzero(reasons)
+
+    print(f'{len(suspects)} suspect frames found in the log')
+
+    cache = FrameCache(cap, args.cache_mb * 2**20)
+
+    # Every correction is saved as soon as it is made, the journal is
+    # created with the first one
+    journal = None
+    corrected = 0
 
     # Delay on each frame
     delay = 0.5
+    playing = True
+    frameIndex = 0
+
+    # Frames are kept within the video, the count is corrected below if
+    # the container announced more than it holds
+    last_frame = num_frames - 1 if num_frames > 0 else np.iinfo(np.int64).max
+
+    def clamp(index):
+        return min(max(index, 0), last_frame)
 
     main_win = 'Video'
     cv.namedWindow(main_win, cv.WINDOW_KEEPRATIO)
     cv.resizeWindow(main_win, 640, 528)
     cv.moveWindow(main_win, 10, 10)
 
-    while(cap.isOpened()):
-        global frame
-        ret, frame = cap.read()
+    # Seeking with the trackbar
+    seek = { 'index': None }
 
-        if(not ret):
-            print('Error reading video stream')
-            break
+    def onSeek(value):
+        seek['index'] = value
+
+    cv.createTrackbar('Frame', main_win, 0, max(num_frames - 1, 1), onSeek)
+
+    while(True):
+        frame = cache.get(frameIndex)
+
+        if(frame is None):
+            print('End of the video stream')
+
+            # Stays on the last frame that decodes to keep reviewing
+            playing = False
+
+            while(frame is None and frameIndex > 0):
+                frameIndex -= 1
+                frame = cache.get(frameIndex)
+
+            if(frame is None):
+                break
+
+            last_frame = frameIndex
+
+        row = rows[frameIndex] if frameIndex < len(rows) else -1
+        position = None
+        if(row >= 0 and xs[row] != 0 and ys[row] != 0):
+            position = toImage((xs[row], ys[row]))
+
+        cv.imshow(main_win, annotate(
+            frame, frameIndex, position,
+            reasons[frameIndex] if frameIndex < len(reasons) else 0, len(suspects)
+        ))
+
+        if(cv.getTrackbarPos('Frame', main_win) != frameIndex):
+            cv.setTrackbarPos('Frame', main_win, frameIndex)
+            seek['index'] = None
+
+        key = cv.waitKey(max(int(delay * 1000), 1) if playing else 30)
 
-        # Read detected objects from file
-        lineNum, cntr = next(file)
-        
-        # Draws detections
-        annotatedFrame = frame.copy()
-        if(cntr[0] != '0' and cntr[1] != '0'):
-            cv.circle(
-                annotatedFrame, 
-                (int(cntr[0]), int(cntr[1])), 
-                5, (42, 89, 247), -1
-            )
-
-        cv.imshow(main_win, annotatedFrame)
-
-        key = cv.waitKey(5)
         # Exit the program
         if(key == 27 or key == 113):
-            cv.destroyAllWindows()
-            cap.release()
             break
 
+        if(seek['index'] is not None):
+            frameIndex, seek['index'] = clamp(seek['index']), None
+            continue
+
+        # Pauses the video stream
+        if(key == 32):
+            playing = not playing
+
         # Increases the delay between each video frame
-        if(key == 115):
+        elif(key == 115):
             delay += 0.25
 
         # Decreases the delay between each video frame
-        if(key == 102 and delay > 0):
+        elif(key == 102 and delay > 0):
             delay -= 0.25
 
-        # Pauses the video stream
-        if(key == 32):
-            while True:
+        # Steps one frame or one second back and forth
+        elif(key in (106, 108, 74, 76)):
+            playing = False
+            step = 1 if key in (106, 108) else frame_rate
+            frameIndex = clamp(frameIndex + (step if key in (108, 76) else -step))
+
+        # Jumps to the next or previous suspect frame
+        elif(key in (110, 112)):
+            playing = False
+
+            if(key == 110):
+                following = suspects[suspects > frameIndex]
+            else:
+                following = suspects[suspects < frameIndex][::-1]
+
+            if(len(following) > 0):
+                frameIndex = clamp(int(following[0]))
+            else:
+                print('No more suspect frames in that direction')
+
+        # Goes to a frame typed in the terminal
+        elif(key == 103):
+            playing = False
+
+            try:
+                frameIndex = clamp(int(input('>>> Go to frame: ')))
+            except ValueError:
+                print('Not a frame number')
+
+        # Edits the position of the current frame
+        elif(key == 100 and not playing):
+            position = editFrame(frame.copy())
+
+            if(position is not None):
+                position = toLog(position)
+
+                if(journal is None):
+                    journal = CorrectionJournal(args.log_file)
 
-                cv.imshow(main_win, annotatedFrame)
+                journal.append(frameIndex, *position)
+                corrected += 1
 
-                key2 = cv.waitKey(5)
-                if(key2 == 32):
-                    break
-                elif(key2 == 27 or key2 == 113):
-                    cv.destroyAllWindows()
-                    cap.release()
-                    break
-                elif(key2 == 100):
-                    editFrame(frame.copy(), lineNum, changes)
+                frames, xs, ys = applyCorrections(
+                    frames, xs, ys,
+                    np.array([frameIndex], dtype=np.int64), np.array([position], dtype=np.float64)
+                )
+                rows = frameRows(frames, num_frames)
 
-        sleep(delay)
+                # The suspects follow the correction
+                reasons = findSuspects(frames, xs, ys, num_frames, args.spike_sigma)
+                suspects = np.flatnonzero(reasons)
 
-    # Write changes to the log file
-    lines = open(args.log_file, 'r').read().splitlines()
+        elif(playing):
+            frameIndex += 1
 
-    for change in changes:
-        lines[change['line']] = change['content']
+    cv.destroyAllWindows()
+    cap.release()
 
-    open(args.log_file, 'w').write('\n'.join(lines))
\ No newline at end of file
+    if(journal is not None):
+        journal.close()
+        print(f'{corrected} corrections saved to {journal.file_path}, merge them into the log with corrections.py --compact')
@@ -0,0 +1,85 @@
+from threading import Thread
+from queue import Queue
+import numpy as np
+
+class FrameSource:
+    # Drop-in for cv.VideoCapture that decodes on a background thread into
+    # a ring of reusable frames. OpenCV releases the GIL while decoding, so
+    # the next frames are decoded while the current one is processed.
+    # A frame returned by read() stays valid until the following read().
+
+    def __init__(self, cap, size=8):
+        self.cap = cap
+
+        width, height = int(cap.get(3)), int(cap.get(4))
+        self.buffers = [ np.empty((height, width, 3), dtype=np.uint8) for _ in range(size) ]
+
+        # Indexes of the buffers waiting to be decoded into and to be read,
+        # the decoder blocks when every buffer is waiting to be read
+        self.free = Queue()
+        self.filled = Queue()
+
+        for index in range(size):
+            self.free.put(index)
+
+        self.current = None
+        self.finished = False
+        self.stopping = False
+
+        self.thread = Thread(target=self._decode, daemon=True)
+        self.thread.start()
+
+    def _decode(self):
+        while True:
+            index = self.free.get()
+
+            if(index is None or self.stopping):
+                # Wakes a reader waiting for a frame
+                self.filled.put(None)
+                return
+
+            ret, frame = self.cap.read(self.buffers[index])
+
+            if(not ret):
+                self.filled.put(None)
+                return
+
+            # The decoder gives back a new array when the size did not match
+            self.buffers[index] = frame
+            self.filled.put(index)
+
+    def read(self):
+        # The previous frame goes back to the decoder
+        if(self.current is not None):
+            self.free.put(self.current)
+            self.current = None
+
+        if(self.finished):
+            return False, None
+
+        index = self.filled.get()
+
+        if(index is None):
+            self.finished = True
+            return False, None
+
+        self.current = index
+
+        return True, self.buffers[index]
+
+    def isOpened(self):
+        return not self.finished and self.cap.isOpened()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def release(self):
+        # Wakes the decoder if it is waiting for a free buffer
+        self.stopping = True
+        self.free.put(None)
+        self.thread.join()
+
+        # A reader still waiting gets the end of the stream
+        self.filled.put(None)
+
+        self.cap.release()
@@ -1,19 +1,34 @@
 from PyQt5.QtWidgets import QApplication, QMainWindow, QSizePolicy, QFileDialog
-from PyQt5.QtCore import QThread, Qt, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import QThread, Qt, pyqtSignal
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtGui import QImage, QPixmap
-from utils import getOrientation
-from time import sleep
-from os import path
+from threading import Condition, Lock
+from time import perf_counter
+from os import path, mkdir
 import numpy as np
 import cv2 as cv
 import sys
 
+# The processing engine is shared with the scripts in the parent directory
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from trajectoryLog import TrajectoryWriter, exportCsv
+from segmentation import Segmenter
+from frameSource import FrameSource
+from videoWriter import AsyncVideoWriter
+from utils import getOrientation, computeOrientation
+from profiling import StageTimer, NULL_TIMER
+
+# Qt 5.14 added a BGR format, older versions get the channels swapped in place
+BGR_FORMAT = getattr(QImage, 'Format_BGR888', None)
+
+# Times per second the view shows the latest analysed frame
+DISPLAY_RATE = 30
+
 class FrameProcessor:
     def __init__(self, options):
         self.file_name = None
-        self.options = options
-        self.set_options(self.options)
+        self.set_options(options)
 
         self.lower_white = np.array([self.options['lower_boundary']] * 3)
         self.upper_white = np.array([self.options['upper_boundary']] * 3)
@@ -26,10 +41,20 @@ class FrameProcessor:
         self.traveled_distance = 0
 
         self.cap = None
+        self.segmenter = None
+        self.trajectory = None
+        self.out_writer = None
+        self.out_frame_rate = None
+
+        # Does nothing unless profiling
+        self.timer = NULL_TIMER
 
     def load_video(self, file_path):
         self.file_name = file_path.split('/')[-1].split('.')[0]
 
+        if (self.cap is not None):
+            self.cap.release()
+
         self.cap = cv.VideoCapture(file_path)
         self.frameWidth = int(self.cap.get(3)) 
         self.frameHeight = int(self.cap.get(4))
@@ -45,100 +70,118 @@ class FrameProcessor:
             print('Error readning video stream')
             exit()
 
+        self.segmenter = Segmenter(
+            self.bg_img, self.lower_white, self.upper_white,
+            channels=self.options['channels']
+        )
+        self.segmenter.timer = self.timer
+
+        # Decodes the next frames while the current one is processed
+        self.cap = FrameSource(self.cap)
+
     def set_options(self, options):
+        # A copy, the options of the thread change while a frame is processed
+        self.options = dict(options)
+
         if (self.file_name is None):
             return
 
-        self.options = options
-
         self.lower_white = np.array([self.options['lower_boundary']] * 3)
         self.upper_white = np.array([self.options['upper_boundary']] * 3)
 
-        # Creates a stream object for writing the output
-        if (self.options['save_video']):
+        if (self.segmenter is not None):
+            if (self.segmenter.channels != self.options['channels']):
+                self.segmenter = Segmenter(
+                    self.bg_img, self.lower_white, self.upper_white,
+                    channels=self.options['channels']
+                )
+            else:
+                self.segmenter.set_boundaries(self.lower_white, self.upper_white)
+
+        if (self.options['profile'] and self.timer is NULL_TIMER):
+            self.timer = StageTimer()
+        elif (not self.options['profile'] and self.timer is not NULL_TIMER):
+            self.write_profile()
+            self.timer = NULL_TIMER
+
+        if (self.segmenter is not None):
+            self.segmenter.timer = self.timer
+
+        # Creates a stream object for writing the output, again only when
+        # the frame rate changes so the frames already saved are kept
+        if (self.options['save_video'] and (self.out_writer is None or self.out_frame_rate != self.options['frame_rate'])):
             result_file_name =  f'./results/{self.file_name}_result.avi'
 
-            self.out_writer = cv.VideoWriter(
+            if (self.out_writer is not None):
+                self.out_writer.release()
+
+            self.out_frame_rate = self.options['frame_rate']
+
+            # Encoding runs on its own thread
+            self.out_writer = AsyncVideoWriter(
                 result_file_name,
                 cv.VideoWriter_fourcc('M', 'J', 'P', 'G'),
                 self.options['frame_rate'], 
                 (self.frameWidth, self.frameHeight)
             )
 
-        # Creates a file for position logging
-        if (self.options['log_position']):
-            self.pos_log_file = f'./results/{self.file_name}_pos.csv'
-
-            if not path.isfile(self.pos_log_file): 
-                with open(self.pos_log_file, 'w') as logFile:
-                    logFile.write('x,y\n')
+        # Positions and speeds are buffered into a binary log, the CSV
+        # files are exported from it when the processor is closed
+        self.pos_log_file = f'./results/{self.file_name}_pos.csv'
+        self.speed_log_file = f'./results/{self.file_name}_speed.csv'
 
-        # Creates a file for position logging
-        if (self.options['log_speed']):
-            self.speed_log_file = f'./results/{self.file_name}_speed.csv'
+        if ((self.options['log_position'] or self.options['log_speed']) and self.trajectory is None):
+            self.trajectory_log_file = f'./results/{self.file_name}.trj'
 
-            if not path.isfile(self.speed_log_file):
-                with open(self.speed_log_file, 'w') as logFile:
-                    logFile.write('time,speed\n')
+            self.trajectory = TrajectoryWriter(
+                self.trajectory_log_file,
+                self.frameWidth, self.frameHeight,
+                self.options['frame_rate']
+            )
 
-    def process_frame(self):
+    def process_frame(self, draw=True):
+        # Annotations are only drawn on the frames that are shown or saved
         
         if (self.cap is None):
             print('Load the video file first')
 
             return None
 
+        timer = self.timer
+
+        began = timer.now()
         ret, frame = self.cap.read()
 
         if (not ret):
-            print('Error readning video stream')
-            exit()
-        
-        sub_frame = cv.absdiff(frame, self.bg_img)
-           
-        filtered_frame = cv.inRange(sub_frame, self.lower_white, self.upper_white)
-        
-        # Kernel for morphological operation opening
-        kernel3 = cv.getStructuringElement(
-            cv.MORPH_ELLIPSE,
-            (3, 3),
-            (-1, -1)
-        )
+            print('End of the video stream')
 
-        kernel20 = cv.getStructuringElement(
-            cv.MORPH_ELLIPSE,
-            (20, 20),
-            (-1, -1)
-        )
+            return None
 
-        # Morphological opening
-        mask = cv.dilate(cv.erode(filtered_frame, kernel3), kernel20)
+        timer.start(began)
+        timer.mark('decode')
+        
+        self.segmenter.segment(frame)
 
-        mask_roi = cv.bitwise_and(sub_frame, sub_frame, mask=mask)
+        angle, area = np.nan, 0
 
-        # Find all the contours in the mask
-        returns = cv.findContours(mask, cv.RETR_LIST, cv.CHAIN_APPROX_NONE)
-        
-        # Check what findContours returned
-        contours = []
-        if (len(returns) == 3):
-            contours = returns[1]
-        else:
-            contours = returns[0]
-        
-        for i, c in enumerate(contours):
-            # Calculate the area of each contour
-            area = cv.contourArea(c)
+        # Ignore contours that are too small or too large
+        contours = self.segmenter.filtered_contours(1e2, 1e5)
+        timer.mark('detect')
 
-            # Ignore contours that are too small or too large
-            if area < 1e2 or 1e5 < area:
-                continue
+        for c in contours:
+            if (draw):
+                # Draw each contour only for visualisation purposes
+                cv.drawContours(frame, [c], 0, (255, 0, 255), 2)
 
-            # Draw each contour only for visualisation purposes
-            cv.drawContours(frame, contours, i, (255, 0, 255), 2)
+                # Find the orientation of each shape
+                self.current_pos, angle = getOrientation(c, frame, self.options['draw_axis'])
+            else:
+                mean, _, _, angle = computeOrientation(c)
+                self.current_pos = (int(mean[0]), int(mean[1]))
 
-            # Find the orientation of each shape
-            self.current_pos, _ = getOrientation(c, frame, self.options['draw_axis'])
+            area = cv.contourArea(c)
+
+        timer.mark('orientation')
 
         speed = np.sqrt(
             (self.previous_pos[0] - self.current_pos[0])**2 + 
@@ -148,62 +191,104 @@ class FrameProcessor:
         self.traveled_distance += speed
         self.previous_pos = self.current_pos
 
-        if (self.options['show_speed']):
+        if (draw and self.options['show_speed']):
             cv.putText(
                 frame, f'{speed:.3f}', self.current_pos,
                 cv.FONT_HERSHEY_COMPLEX,
                 0.5, (255, 255, 255)
             )
 
-        if(self.options['log_speed']):
-            if(self.current_pos[0] > 50 and self.current_pos[1] > 50):        
-                with open(self.speed_log_file, 'a') as logFile:
-                    logFile.write(f'{self.frame_index * (1/float(self.options["frame_rate"])):.3f},{speed:.3f}\n')
+        if(draw and self.options['color_mask']):
+            # Apply the mask with its own color
+            self.segmenter.overlay_mask(frame, (222, 70, 222))
 
-        # Save position to file
-        if(self.options['log_position']):
-            with open(self.pos_log_file, 'a') as logFile:
-                if(self.current_pos[0] > 50 and self.current_pos[1] > 50):
-                    # Changes the coordinates' center to the bottom left for later plotting
-                    logFile.write(f'{self.current_pos[0]},{self.frameHeight - self.current_pos[1]}\n')
+        timer.mark('drawing')
 
-        if(self.options['color_mask']):
-            # Change the color of the mask
-            colored_mask = cv.cvtColor(mask, cv.COLOR_GRAY2BGR)
-            colored_mask[np.where((colored_mask == [255, 255, 255]).all(axis = 2))] = [222, 70, 222]
+        if(self.options['log_position'] or self.options['log_speed']):
+            # Frames are numbered as in the video, after the background frame
+            self.trajectory.write(
+                self.frame_index + 1, self.frame_index * (1/float(self.options['frame_rate'])),
+                self.current_pos[0], self.current_pos[1],
+                angle, area, speed
+            )
 
-            # Apply the mask
-            frame = cv.add(frame, colored_mask)        
+            timer.mark('logging')
 
         self.frame_index += 1
         
         if(self.options['save_video']):
             self.out_writer.write(frame)
+            timer.mark('writing')
 
-        height, width, _ = frame.shape
-
-        if (height < 660 or width < 1091):
-            padding_height = max(660 - height, 0)//2
-            padding_width = max(1091 - width, 0)//2
-            
-            frame = cv.copyMakeBorder(
-                frame, 
-                padding_height, padding_height, 
-                padding_width, padding_width, 
-                cv.BORDER_CONSTANT
-            )
-        else:
-            frame = cv.resize(frame, (1091, 660))
+        if (timer.should_snapshot(30)):
+            print(timer.snapshot())
 
+        # At the video resolution, scaled only for the view
         return frame
 
+    def write_profile(self):
+        if (self.timer is NULL_TIMER or self.file_name is None):
+            return
+
+        if (not path.exists('./results')):
+            mkdir('./results')
+
+        print(self.timer.snapshot())
+        self.timer.write(
+            f'./results/{self.file_name}_profile.json',
+            f'./results/{self.file_name}_profile.csv'
+        )
+
+    def close(self):
+        self.write_profile()
+
+        if (self.trajectory is not None):
+            self.trajectory.close()
+
+            exportCsv(
+                self.trajectory_log_file,
+                self.pos_log_file if self.options['log_position'] else None,
+                self.speed_log_file if self.options['log_speed'] else None
+            )
+
+            self.trajectory = None
+
+        if (self.out_writer is not None):
+            dropped = self.out_writer.release()
+            self.out_writer = None
+
+            if (dropped > 0):
+                print(f'{dropped} frames dropped while saving the video')
+
 class Thread(QThread):
-    changePixmap = pyqtSignal(QImage)
+    # Plays the video paced to its frame rate times the chosen speed. The
+    # thread sleeps on a condition while paused and between frames. Every
+    # frame is analysed, logged and saved, while the view only takes the
+    # latest annotated frame DISPLAY_RATE times a second, so the analysis
+    # never waits for Qt to paint.
+
+    statusChanged = pyqtSignal(str)
 
     def __init__(self, parent=None):
         QThread.__init__(self, parent=parent)       
 
-        self.paused = False
+        self.condition = Condition()
+        self.playing = False
+        self.stopping = False
+
+        # Set while a frame is being processed, the options changed
+        # meanwhile are handed to the processor once it is done
+        self.busy = False
+        self.options_changed = False
+
+        # Frames scaled to the view, one is written while the view reads
+        # the other. The lock guards swapping them
+        self.view_size = (1091, 660)
+        self.display_lock = Lock()
+        self.display_buffers = [None, None]
+        self.display_images = [None, None]
+        self.front = 0
+        self.fresh = False
 
         self.options = {
             'log_speed': False,
@@ -214,7 +299,10 @@ class Thread(QThread):
             'log_position': False,
             'lower_boundary': 100,
             'upper_boundary': 160,
-            'frame_rate': 30
+            'channels': 'bgr',
+            'profile': False,
+            'frame_rate': 30,
+            'speed': 1.0
         }
 
         self.processor = FrameProcessor(self.options)
@@ -222,34 +310,177 @@ class Thread(QThread):
         self.set_placeholder()
 
     def play_pause(self):
-        self.paused = not self.paused
+        with self.condition:
+            self.playing = not self.playing
+            self.condition.notify_all()
+
+    def pause(self):
+        # Returns once the processor is no longer in use, so it can be changed
+        with self.condition:
+            self.playing = False
+            self.condition.notify_all()
+
+            while (self.busy):
+                self.condition.wait()
+
+    def set_options(self, **changes):
+        # The processor is never changed in the middle of a frame
+        with self.condition:
+            self.options.update(changes)
+
+            if (self.busy):
+                self.options_changed = True
+            else:
+                self.processor.set_options(self.options)
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+        self.wait()
+
+    def latest_pixmap(self):
+        # Called by the view, None when there is nothing new to show
+        with self.display_lock:
+            if (not self.fresh):
+                return None
+
+            self.fresh = False
+
+            return QPixmap.fromImage(self.display_images[self.front])
+
+    def display(self, result):
+        # The frame is scaled once, straight into the buffer handed to Qt
+        back = 1 - self.front
+
+        height, width, _ = result.shape
+        view_width, view_height = self.view_size
+
+        scale = min(view_width / width, view_height / height)
+        size = (max(int(width * scale), 1), max(int(height * scale), 1))
+
+        buffer = self.display_buffers[back]
+
+        if (buffer is None or buffer.shape[:2] != (size[1], size[0])):
+            buffer = self.display_buffers[back] = np.empty((size[1], size[0], 3), dtype=np.uint8)
+
+        if (size == (width, height)):
+            np.copyto(buffer, result)
+        else:
+            cv.resize(result, size, dst=buffer, interpolation=cv.INTER_AREA)
+
+        image_format = BGR_FORMAT
+        if (image_format is None):
+            cv.cvtColor(buffer, cv.COLOR_BGR2RGB, dst=buffer)
+            image_format = QImage.Format_RGB888
+
+        # Kept alive with its buffer until it is replaced
+        self.display_images[back] = QImage(
+            buffer.data, size[0], size[1], buffer.strides[0], image_format
+        )
+
+        with self.display_lock:
+            self.front = back
+            self.fresh = True
+
+        self.processor.timer.mark('display')
 
     def set_placeholder(self):
         image = cv.imread('./icons/placeholder.png')
-        image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
 
-        height, width, _ = image.shape
-        bytesPerLine = 3 * width
-        
-        convertToQtFormat = QImage(image.data, width, height, bytesPerLine, QtGui.QImage.Format_RGB888)
-                
-        self.changePixmap.emit(convertToQtFormat)
+        if (image is not None):
+            self.display(image)
 
     def run(self):
+        next_time = None
+        next_display = 0
+
+        # Frames analysed and handed to the view since the status was last updated
+        processed = displayed = 0
+        status_time = perf_counter()
+
         while True:
-            if  (not self.paused):
+            with self.condition:
+                while (not self.playing and not self.stopping):
+                    next_time = None
+                    self.condition.wait()
+
+                if (self.stopping):
+                    return
+
+            # Speed 0 plays as fast as the analysis goes
+            rate = self.options['frame_rate'] * self.options['speed']
+            period = 1 / rate if rate > 0 else 0
+
+            now = perf_counter()
+
+            if (next_time is None):
+                next_time = now
+            elif (next_time > now):
+                # Woken early by a pause or the window closing
+                with self.condition:
+                    self.condition.wait(next_time - now)
+
+                continue
+
+            # Only the frame the view is going to take is annotated, unless
+            # every frame is saved
+            show = now >= next_display
+
+            with self.condition:
+                # Paused meanwhile
+                if (not self.playing):
+                    continue
+
+                self.busy = True
+
+            try:
+                result = self.processor.process_frame(show or self.options['save_video'])
+            finally:
+                with self.condition:
+                    self.busy = False
+
+                    if (self.options_changed):
+                        self.options_changed = False
+                        self.processor.set_options(self.options)
+
+                    self.condition.notify_all()
+
+            if (result is None):
+                with self.condition:
+                    self.playing = False
+
+                self.statusChanged.emit(
+                    'Load the video file first' if self.processor.cap is None else 'End of the video'
+                )
                 continue
 
-            result = self.processor.process_frame()
+            processed += 1
+            next_time += period
 
-            image = cv.cvtColor(result, cv.COLOR_BGR2RGB)
+            if (show):
+                self.display(result)
+                displayed += 1
+                next_display = now + 1 / DISPLAY_RATE
 
-            height, width, _ = image.shape
-            bytesPerLine = 3 * width
-            
-            convertToQtFormat = QImage(image.data, width, height, bytesPerLine, QtGui.QImage.Format_RGB888)
-                    
-            self.changePixmap.emit(convertToQtFormat)
+            now = perf_counter()
+
+            # Too far behind to catch up, the schedule restarts from now
+            if (now - next_time > 0.5):
+                next_time = now
+
+            elapsed = now - status_time
+
+            if (elapsed >= 1):
+                target = f'target {rate:.1f} fps' if rate > 0 else 'as fast as possible'
+
+                self.statusChanged.emit(
+                    f'{processed / elapsed:.1f} fps analysed, {displayed / elapsed:.1f} fps displayed ({target})'
+                )
+
+                processed = displayed = 0
+                status_time = now
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -263,8 +494,13 @@ class MainWindow(QMainWindow):
 
         self.setupUi(self)
 
-        self.th.changePixmap.connect(self.set_frame)
-        self.th.set_placeholder()
+        self.th.statusChanged.connect(self.statusBar().showMessage)
+
+        # The view takes the latest analysed frame at a fixed rate
+        self.view_timer = QtCore.QTimer(self)
+        self.view_timer.timeout.connect(self.refresh_view)
+        self.view_timer.start(1000 // DISPLAY_RATE)
+
         self.th.start()
 
         self.show()
@@ -285,8 +521,13 @@ class MainWindow(QMainWindow):
         # self.frame.setObjectName('frame')
         # self.gridLayout.addWidget(self.frame, 1, 0, 1, 1)
 
+        # Ignores the size of the frames, which are scaled to the label instead
         self.image_frame = QtWidgets.QLabel()
         self.image_frame.setObjectName('image_frame')
+        self.image_frame.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self.image_frame.setMinimumSize(QtCore.QSize(320, 240))
+        self.image_frame.setAlignment(Qt.AlignCenter)
+        self.image_frame.installEventFilter(self)
         self.gridLayout.addWidget(self.image_frame, 1, 0, 1, 1)
         
         self.sideBar = QtWidgets.QVBoxLayout()
@@ -351,6 +592,11 @@ class MainWindow(QMainWindow):
         self.colorMask.setObjectName("colorMask")
         self.colorMask.stateChanged.connect(lambda: self.change_options('color_mask'))
         self.opitionalSettings.addWidget(self.colorMask, 6, 0, 1, 1)
+
+        self.profile = QtWidgets.QCheckBox(self.allFather)
+        self.profile.setObjectName("profile")
+        self.profile.stateChanged.connect(lambda: self.change_options('profile'))
+        self.opitionalSettings.addWidget(self.profile, 11, 0, 1, 1)
         
         self.sideBar.addLayout(self.opitionalSettings)
         spacerItem = QtWidgets.QSpacerItem(
@@ -384,6 +630,21 @@ class MainWindow(QMainWindow):
         self.line_2.setFrameShadow(QtWidgets.QFrame.Sunken)
         self.line_2.setObjectName("line_2")
         self.frameRate.addWidget(self.line_2, 4, 0, 1, 1)
+
+        self.horizontalLayout_5 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_5.setObjectName("horizontalLayout_5")
+
+        self.speedLabel = QtWidgets.QLabel(self.allFather)
+        self.speedLabel.setObjectName("speedLabel")
+        self.horizontalLayout_5.addWidget(self.speedLabel)
+
+        self.speed = QtWidgets.QComboBox(self.allFather)
+        self.speed.addItems(['0.25x', '0.5x', '1x', '2x', '4x', 'Max'])
+        self.speed.setCurrentText('1x')
+        self.speed.setObjectName("speed")
+        self.speed.currentTextChanged.connect(self.change_speed)
+        self.horizontalLayout_5.addWidget(self.speed)
+        self.frameRate.addLayout(self.horizontalLayout_5, 7, 0, 1, 1)
         
         self.sideBar.addLayout(self.frameRate)
         spacerItem1 = QtWidgets.QSpacerItem(
@@ -440,6 +701,20 @@ class MainWindow(QMainWindow):
         self.upperBoundary.setObjectName("upperBoundary")
         self.horizontalLayout_3.addWidget(self.upperBoundary)
         self.colorSettings.addLayout(self.horizontalLayout_3, 4, 0, 1, 1)
+
+        self.horizontalLayout_4 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_4.setObjectName("horizontalLayout_4")
+
+        self.channelsLabel = QtWidgets.QLabel(self.allFather)
+        self.channelsLabel.setObjectName("channelsLabel")
+        self.horizontalLayout_4.addWidget(self.channelsLabel)
+
+        self.channels = QtWidgets.QComboBox(self.allFather)
+        self.channels.addItems(['bgr', 'gray', 'max'])
+        self.channels.setObjectName("channels")
+        self.channels.currentTextChanged.connect(self.change_channels)
+        self.horizontalLayout_4.addWidget(self.channels)
+        self.colorSettings.addLayout(self.horizontalLayout_4, 6, 0, 1, 1)
         
         self.sideBar.addLayout(self.colorSettings)
         spacerItem2 = QtWidgets.QSpacerItem(
@@ -529,6 +804,12 @@ class MainWindow(QMainWindow):
             "MainWindow", "Draws a colored mask over the detection."
         ))
         
+        self.profile.setText(_translate("MainWindow", "Profile"))
+        self.profile.setToolTip(_translate(
+            "MainWindow", "Measures the time spent in each stage, the report\
+            is written to the results directory when the video is closed."
+        ))
+
         self.saveVideo.setText(_translate("MainWindow", "Save Video"))
         self.saveVideo.setToolTip(_translate(
             "MainWindow", "Creates a video file with the analysis results."
@@ -539,6 +820,12 @@ class MainWindow(QMainWindow):
         
         self.label_1.setText(_translate("MainWindow", "Frame Rate"))
         self.label_1.setToolTip(_translate("MainWindow", "Sets the video\'s frame rate."))
+
+        self.speedLabel.setText(_translate("MainWindow", "Playback Speed"))
+        self.speed.setToolTip(_translate(
+            "MainWindow", "Plays the video at this multiple of its frame rate,\
+            Max analyses it as fast as possible."
+        ))
         
         self.colorLabel.setText(_translate("MainWindow", "Color Settings"))
         self.colorLabel.setToolTip(_translate(
@@ -551,6 +838,12 @@ class MainWindow(QMainWindow):
         
         self.upperBoundaryLabel.setText(_translate("MainWindow", "Upper Boundary"))
         self.colorSettingsBtn.setText(_translate("MainWindow", "Change"))
+
+        self.channelsLabel.setText(_translate("MainWindow", "Channels"))
+        self.channels.setToolTip(_translate(
+            "MainWindow", "Compares every colour channel with the background,\
+            or only the grey levels or the brightest channel, which is faster."
+        ))
         
         self.playBtn.setText(_translate("MainWindow", "Play/Pause"))
         self.playBtn.setToolTip(_translate("MainWindow", "Resumes or pause the video stream."))
@@ -575,34 +868,56 @@ class MainWindow(QMainWindow):
         )
 
         if choice == QtWidgets.QMessageBox.Yes:
+            self.th.stop()
+            self.th.processor.close()
             sys.exit()
 
     def open_file(self):
         self.video_file_name, _ = QFileDialog.getOpenFileName(self)
 
+        # The playback thread must not be reading from the video being replaced
+        self.th.pause()
         self.th.processor.load_video(self.video_file_name)
 
         self.statusBar().showMessage('Video loaded!')
 
     def change_options(self, option):
-        self.th.options[option] =  not self.th.options[option] 
-
-        self.th.processor.set_options(self.th.options)
+        self.th.set_options(**{ option: not self.th.options[option] })
 
     def change_frame_rate(self):
-        self.th.options['frame_rate'] = self.inputedFrameRate.value()
-
-        self.th.processor.set_options(self.th.options)
+        self.th.set_options(frame_rate=self.inputedFrameRate.value())
 
     def change_boundaries(self):
-        self.th.options['lower_boundary'] = self.lowerBoundary.value()
-        self.th.options['upper_boundary'] = self.upperBoundary.value()
+        self.th.set_options(
+            lower_boundary=self.lowerBoundary.value(),
+            upper_boundary=self.upperBoundary.value()
+        )
+
+    def change_channels(self, channels):
+        self.th.set_options(channels=channels)
+
+    def change_speed(self, speed):
+        # Speed 0 plays as fast as possible, only the thread reads it
+        self.th.options['speed'] = 0 if speed == 'Max' else float(speed[:-1])
+
+    def eventFilter(self, watched, event):
+        # Frames are scaled to the label on the worker thread
+        if (watched is self.image_frame and event.type() == QtCore.QEvent.Resize):
+            self.th.view_size = (event.size().width(), event.size().height())
+
+        return super(MainWindow, self).eventFilter(watched, event)
+
+    def closeEvent(self, event):
+        # The processor is only closed once the thread stopped using it
+        self.th.stop()
+        self.th.processor.close()
+        event.accept()
 
-        self.th.processor.set_options(self.th.options)
+    def refresh_view(self):
+        pixmap = self.th.latest_pixmap()
 
-    @pyqtSlot(QImage)
-    def set_frame(self, frame):
-        self.image_frame.setPixmap(QPixmap.fromImage(frame))
+        if (pixmap is not None):
+            self.image_frame.setPixmap(pixmap)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
@@ -1,9 +1,19 @@
 from matplotlib.ticker import FuncFormatter
 from matplotlib import pyplot as plt
-from scipy.stats import kde
-import pandas as pd
+from corrections import loadPositions, iterPositions
+from multiprocessing import Pool
+from os import cpu_count, path
+from scipy.ndimage import gaussian_filter
+from scipy.signal import fftconvolve
+from scipy.stats import gaussian_kde
+from time import perf_counter
 import numpy as np
 import argparse
+import glob
+import csv
+
+DENSITY_METHODS = ('fft', 'separable', 'kde')
+AGGREGATIONS = ('sum', 'mean')
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -12,7 +22,7 @@ def parse_args():
 
     parser.add_argument(
         'log_file', type=str,
-        help='Path to the log file'
+        help='Path to the log file, or a quoted glob pattern matching the logs of several sessions'
     )
 
     parser.add_argument(
@@ -25,52 +35,331 @@ def parse_args():
         help='Frame height of the processed video'
     )
 
+    parser.add_argument(
+        '--method', type=str, default='fft', choices=DENSITY_METHODS,
+        help='How the density is estimated: binned positions smoothed by FFT convolution (fft) or by separable Gaussian filters (separable), or the exact kernel density estimation (kde, slow on long recordings).'
+    )
+
+    parser.add_argument(
+        '--bins', type=int, default=200,
+        help='Cells of the density grid along the frame width, square cells.'
+    )
+
+    parser.add_argument(
+        '--bandwidth', type=float, default=None,
+        help='Standard deviation of the Gaussian kernel in pixels, by default from Scott\'s rule.'
+    )
+
+    parser.add_argument(
+        '--manifest', action='store_true',
+        help='The log file is a CSV manifest with a log_file column listing the logs.'
+    )
+
+    parser.add_argument(
+        '--aggregate', type=str, default='sum', choices=AGGREGATIONS,
+        help='How the sessions are combined: by their positions (sum) or each session counting the same (mean).'
+    )
+
+    parser.add_argument(
+        '--processes', type=int, default=0,
+        help='Number of logs read at the same time, 0 uses every core.'
+    )
+
+    parser.add_argument(
+        '--chunk-size', type=int, default=1000000,
+        help='Rows of a log read at once.'
+    )
+
+    parser.add_argument(
+        '--trajectory-points', type=int, default=20000,
+        help='Positions of a single session drawn at most as its trajectory, evenly spaced in time, 0 leaves the trajectory out.'
+    )
+
+    parser.add_argument(
+        '--compare', type=int, default=0,
+        help='Compares the binned density with the exact one on this many positions and exits.'
+    )
+
     return parser.parse_args()
 
 def numberFormatter(x, pos):
     return f'{int(x * 10e5)}'
 
+def gridShape(width, height, bins):
+    # Rows and columns of a grid of square cells over the frame
+    return max(int(round(bins * height / width)), 1), max(bins, 1)
+
+def positionMoments(x, y):
+    # Sums from which the spread of the positions of many chunks is known
+    return np.array([len(x), x.sum(), (x * x).sum(), y.sum(), (y * y).sum()])
+
+def scottBandwidth(moments):
+    # Kernel deviation of each axis in pixels, n^(-1/6) for two dimensions
+    count = max(moments[0], 1)
+    factor = count ** (-1 / 6)
+
+    std_x = np.sqrt(max(moments[2] / count - (moments[1] / count)**2, 0))
+    std_y = np.sqrt(max(moments[4] / count - (moments[3] / count)**2, 0))
+
+    return max(std_x * factor, 1.0), max(std_y * factor, 1.0)
+
+def binPositions(x, y, width, height, shape):
+    # Positions counted in each cell, rows are y
+    counts, _, _ = np.histogram2d(
+        y, x, bins=shape, range=((0, height), (0, width))
+    )
+
+    return counts
+
+def accumulateLog(log_file, width, height, shape, chunk_size, trajectory_points=0):
+    # Counts of a log read chunk by chunk. Every stride-th position is kept
+    # for the trajectory, the stride doubling whenever more than
+    # trajectory_points are kept, so the memory used stays bounded however
+    # long the recording is
+    counts = np.zeros(shape)
+    moments = np.zeros(5)
+
+    sample_x, sample_y = np.empty(0), np.empty(0)
+    stride = 1
+    offset = 0
+
+    for _, x, y in iterPositions(log_file, chunk_size=chunk_size):
+        counts += binPositions(x, y, width, height, shape)
+        moments += positionMoments(x, y)
+
+        if(trajectory_points > 0):
+            # First position of the chunk on the stride
+            start = -offset % stride
+
+            sample_x = np.concatenate((sample_x, x[start::stride]))
+            sample_y = np.concatenate((sample_y, y[start::stride]))
+
+            # The first kept position is the first one, so halving keeps
+            # positions on the doubled stride
+            while(len(sample_x) > trajectory_points):
+                sample_x, sample_y = sample_x[::2], sample_y[::2]
+                stride *= 2
+
+        offset += len(x)
+
+    trajectory = (sample_x, sample_y) if len(sample_x) > 0 else None
+
+    return counts, moments, trajectory
+
+def _accumulateJob(job):
+    log_file = job[0]
+
+    try:
+        counts, moments, _ = accumulateLog(*job)
+    except (OSError, ValueError, KeyError) as e:
+        return log_file, None, None, repr(e)
+
+    return log_file, counts, moments, None
+
+def findLogs(log_file, manifest):
+    if(manifest):
+        # Relative paths are taken from the manifest's directory
+        with open(log_file, 'r', newline='') as file:
+            return [
+                path.join(path.dirname(log_file), row['log_file'])
+                for row in csv.DictReader(file)
+                if row.get('log_file')
+            ]
+
+    if(glob.has_magic(log_file)):
+        return sorted(glob.glob(log_file))
+
+    return [log_file]
+
+def gaussianKernel(sigma, shape):
+    # Gaussian sampled on the grid up to four deviations, never larger than the grid
+    radius = [ min(int(np.ceil(4 * s)), size) for s, size in zip(sigma, shape) ]
+
+    rows = np.exp(-0.5 * (np.arange(-radius[0], radius[0] + 1) / sigma[0])**2)
+    cols = np.exp(-0.5 * (np.arange(-radius[1], radius[1] + 1) / sigma[1])**2)
+
+    kernel = np.outer(rows, cols)
+
+    return kernel / kernel.sum()
+
+def smoothCounts(counts, sigma, method):
+    # Cost grows with the grid, not with the number of positions
+    if(method == 'separable'):
+        return gaussian_filter(counts, sigma, mode='constant', truncate=4.0)
+
+    smoothed = fftconvolve(counts, gaussianKernel(sigma, counts.shape), mode='same')
+
+    # Rounding of the transform leaves tiny negative values
+    return np.maximum(smoothed, 0, out=smoothed)
+
+def binnedDensity(counts, total, width, height, bandwidth, method):
+    # Density per square pixel, integrates to one over the frame
+    cell_height = height / counts.shape[0]
+    cell_width = width / counts.shape[1]
+
+    sigma = (bandwidth[1] / cell_height, bandwidth[0] / cell_width)
+
+    return smoothCounts(counts, sigma, method) / (max(total, 1) * cell_width * cell_height)
+
+def cellCentres(width, height, shape):
+    return (
+        (np.arange(shape[1]) + 0.5) * width / shape[1],
+        (np.arange(shape[0]) + 0.5) * height / shape[0]
+    )
+
+def exactDensity(x, y, width, height, shape, bandwidth):
+    # The same product kernel evaluated at every cell centre with every
+    # position, O(positions x cells), only for small inputs
+    cx, cy = cellCentres(width, height, shape)
+
+    kx = np.exp(-0.5 * ((cx[:, None] - x[None, :]) / bandwidth[0])**2)
+    ky = np.exp(-0.5 * ((cy[:, None] - y[None, :]) / bandwidth[1])**2)
+
+    return (ky @ kx.T) / (max(len(x), 1) * 2 * np.pi * bandwidth[0] * bandwidth[1])
+
+def kdeDensity(x, y, width, height, shape):
+    # SciPy's estimation with its own full covariance bandwidth
+    cx, cy = cellCentres(width, height, shape)
+    xi, yi = np.meshgrid(cx, cy)
+
+    kernel = gaussian_kde(np.vstack((x, y)))
+
+    return kernel(np.vstack((xi.ravel(), yi.ravel()))).reshape(shape)
+
+def compareDensities(x, y, width, height, shape, bandwidth, points, seed=0):
+    # Binned estimates against the exact one on a sample of the positions
+    if(len(x) > points):
+        sample = np.random.default_rng(seed).choice(len(x), points, replace=False)
+        x, y = x[sample], y[sample]
+
+    start_time = perf_counter()
+    exact = exactDensity(x, y, width, height, shape, bandwidth)
+    elapsed = perf_counter() - start_time
+
+    print(f'{len(x)} positions, {shape[1]}x{shape[0]} cells, bandwidth {bandwidth[0]:.1f} x {bandwidth[1]:.1f} px')
+    print(f'{"method":<12}{"ms":>10}{"max error":>12}{"mean error":>12}{"correlation":>13}')
+    print(f'{"exact":<12}{1000 * elapsed:>10.2f}')
+
+    peak = max(exact.max(), 1e-300)
+
+    for method in ('fft', 'separable'):
+        start_time = perf_counter()
+        counts = binPositions(x, y, width, height, shape)
+        density = binnedDensity(counts, len(x), width, height, bandwidth, method)
+        elapsed = perf_counter() - start_time
+
+        # Errors relative to the peak of the exact density
+        error = np.abs(density - exact) / peak
+
+        print(
+            f'{method:<12}{1000 * elapsed:>10.2f}'
+            f'{error.max():>12.2%}{error.mean():>12.4%}'
+            f'{np.corrcoef(density.ravel(), exact.ravel())[0, 1]:>13.5f}'
+        )
+
 if __name__ == '__main__':
     args = parse_args()
 
-    data = pd.read_csv(args.log_file)
-    x, y = data.x.values, data.y.values
-    points = np.vstack((x, y)).T 
+    logs = findLogs(args.log_file, args.manifest)
 
-    # x, y, points = processFile(args.log_file)
+    if(len(logs) == 0):
+        print(f'No logs found for {args.log_file}')
+        exit()
 
-    nbins = 20
+    shape = gridShape(args.frameWidth, args.frameHeight, args.bins)
 
-    fig, axes = plt.subplots(ncols=2, nrows=1, figsize=(12, 5))
+    if(args.compare > 0 or args.method == 'kde'):
+        if(len(logs) > 1):
+            print('The exact density is only estimated for a single log')
+            exit()
 
-    #axes[0].set_title('Trajectory')
-    axes[0].set(
-        title='Trajectory', 
-        xlim=(0, args.frameWidth), 
-        xticks=list(range(0, args.frameWidth, 60)),
-        ylim=(0, args.frameHeight),
-        yticks=list(range(0, args.frameHeight, 60))
-    )
+        # Every position in memory, corrections made with detectionsAnalyser.py included
+        _, x, y = loadPositions(logs[0], args.chunk_size)
+
+        bandwidth = (args.bandwidth, args.bandwidth) if args.bandwidth else scottBandwidth(positionMoments(x, y))
+
+        if(args.compare > 0):
+            compareDensities(x, y, args.frameWidth, args.frameHeight, shape, bandwidth, args.compare)
+            exit()
+
+        density = kdeDensity(x, y, args.frameWidth, args.frameHeight, shape)
+        trajectory = None
 
-    axes[0].plot(x, y, 'k')
+        if(args.trajectory_points > 0 and len(x) > 0):
+            stride = int(np.ceil(len(x) / args.trajectory_points))
+            trajectory = (x[::stride], y[::stride])
+        sessions = 1
+    else:
+        counts = np.zeros(shape)
+        moments = np.zeros(5)
+        sessions = 0
+        trajectory = None
 
-    # Evaluate a gaussian the kernel density estimation on a regular grid of nbins x nbins
-    k = kde.gaussian_kde(points.T)
-    xi, yi = np.mgrid[x.min():x.max():nbins*1j, y.min():y.max():nbins*1j]
-    zi = k(np.vstack([xi.flatten(), yi.flatten()]))
+        if(len(logs) == 1):
+            counts, moments, trajectory = accumulateLog(
+                logs[0], args.frameWidth, args.frameHeight, shape, args.chunk_size,
+                args.trajectory_points
+            )
+            sessions = 1
+        else:
+            jobs = [ (log, args.frameWidth, args.frameHeight, shape, args.chunk_size) for log in logs ]
+            processes = args.processes if args.processes > 0 else cpu_count()
+
+            # Only one grid per session is in memory at a time
+            with Pool(min(processes, len(jobs))) as pool:
+                for log, log_counts, log_moments, error in pool.imap_unordered(_accumulateJob, jobs):
+                    if(error is not None):
+                        print(f'[failed] {log}: {error}')
+                        continue
+
+                    if(args.aggregate == 'mean'):
+                        log_counts /= max(log_counts.sum(), 1)
+
+                    counts += log_counts
+                    moments += log_moments
+                    sessions += 1
+
+            print(f'{sessions} of {len(logs)} sessions aggregated')
+
+        bandwidth = (args.bandwidth, args.bandwidth) if args.bandwidth else scottBandwidth(moments)
+
+        # Averaged sessions are fractions of each session's positions
+        total = sessions if args.aggregate == 'mean' and len(logs) > 1 else moments[0]
+
+        density = binnedDensity(counts, total, args.frameWidth, args.frameHeight, bandwidth, args.method)
+
+    if(trajectory is not None):
+        fig, axes = plt.subplots(ncols=2, nrows=1, figsize=(12, 5))
+        heatmap_axes = axes[1]
+
+        #axes[0].set_title('Trajectory')
+        axes[0].set(
+            title='Trajectory',
+            xlim=(0, args.frameWidth),
+            xticks=list(range(0, args.frameWidth, 60)),
+            ylim=(0, args.frameHeight),
+            yticks=list(range(0, args.frameHeight, 60))
+        )
+
+        axes[0].plot(trajectory[0], trajectory[1], 'k')
+        plt.setp(axes[0].xaxis.get_majorticklabels(), rotation=70)
+    else:
+        fig, heatmap_axes = plt.subplots(ncols=1, nrows=1, figsize=(6, 5))
 
     # Plot density with shading
     #axes[1].set_title('Heatmap')
-    axes[1].set(
-        title='Heatmap', 
+    heatmap_axes.set(
+        title='Heatmap' if sessions == 1 else f'Heatmap of {sessions} sessions',
         xticks=list(range(0, args.frameWidth, 60)),
         yticks=list(range(0, args.frameHeight, 60))
     )
 
-    pc = axes[1].pcolormesh(xi, yi, zi.reshape(xi.shape), shading='gouraud', cmap=plt.cm.jet)
+    pc = heatmap_axes.imshow(
+        density, origin='lower', extent=(0, args.frameWidth, 0, args.frameHeight),
+        interpolation='bilinear', aspect='auto', cmap=plt.cm.jet
+    )
 
     fig.colorbar(pc, format=FuncFormatter(numberFormatter))
-    plt.setp(axes[0].xaxis.get_majorticklabels(), rotation=70)
-    plt.setp(axes[1].xaxis.get_majorticklabels(), rotation=70)
+    plt.setp(heatmap_axes.xaxis.get_majorticklabels(), rotation=70)
     plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    plt.show()
@@ -1,6 +1,12 @@
+from segmentation import Segmenter
+from background import cachedBackground
+from frameSource import FrameSource
+from videoWriter import AsyncVideoWriter
+from profiling import makeTimer, reportAtExit
 from utils import drawAxis, getOrientation
 import numpy as np
 import cv2 as cv
+from os import makedirs
 import argparse
 
 def parser_args():
@@ -33,6 +39,36 @@ def parser_args():
         help='Create a video file with the analysis result.'
     )
 
+    parser.add_argument(
+        '--median-bg', action='store_true',
+        help='Uses the median of frames spread over the video as background instead of the first frame.'
+    )
+
+    parser.add_argument(
+        '--channels', type=str, default='bgr', choices=['bgr', 'gray', 'max'],
+        help='Compares every colour channel with the background, or only the grey levels or the brightest channel.'
+    )
+
+    parser.add_argument(
+        '--morphology', type=str, default='ellipse', choices=['ellipse', 'rect', 'iterated', 'distance'],
+        help='How the opening is computed, see compareMorphology.py for their cost and accuracy.'
+    )
+
+    parser.add_argument(
+        '--detector', type=str, default='contours', choices=['contours', 'components'],
+        help='Traces every contour of the mask (best on clean masks), or labels its blobs, large masks at a reduced size first, and traces only the chosen ones (best on masks cluttered with many small blobs).'
+    )
+
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='Measures the time spent in each stage and writes a report to ./logs/<video>_profile.json and .csv.'
+    )
+
+    parser.add_argument(
+        '--profile-interval', type=float, default=30.0,
+        help='Seconds between the profiling snapshots printed while running, 0 prints only the final one.'
+    )
+
     return parser.parse_args()
 
 if __name__ == '__main__':
@@ -53,6 +89,16 @@ if __name__ == '__main__':
         print('Error readning video stream')
         exit()
 
+    if(args.median_bg):
+        # Cached for later runs of the same video
+        median_bg = cachedBackground(args.video)
+
+        if(median_bg is not None):
+            bg_img = median_bg
+
+    # Decodes the next frames while the current one is processed
+    cap = FrameSource(cap)
+
     if(args.show_mask):
         mask_win = "Mask"
         cv.namedWindow(mask_win, cv.WINDOW_KEEPRATIO)
@@ -66,85 +112,80 @@ if __name__ == '__main__':
     lower_white = np.array([100, 100, 100])
     upper_white = np.array([160, 160, 160])
 
+    segmenter = Segmenter(
+        bg_img, lower_white, upper_white,
+        channels=args.channels, morphology=args.morphology,
+        detector=args.detector
+    )
+
+    # Does nothing unless profiling
+    timer = makeTimer(args.profile)
+    segmenter.timer = timer
+
+    if(args.profile):
+        makedirs('./logs', exist_ok=True)
+
+        profileName = './logs/' + args.video.split('/')[-1].split('.')[0] + '_profile'
+        reportAtExit(timer, profileName + '.json', profileName + '.csv')
+
     if(args.save_video):
         resultFileName = args.video.split('/')[-1].split('.')[0] + '_result.avi'
 
-        outWriter = cv.VideoWriter(
+        # Encoding runs on its own thread
+        outWriter = AsyncVideoWriter(
             resultFileName,
             cv.VideoWriter_fourcc('M', 'J', 'P', 'G'),
             30, (frameWidth, frameHeight)
         )
 
     while(cap.isOpened()):
+        began = timer.now()
         ret, frame = cap.read()
 
         if(not ret):
             print('Error readning video stream')
-            exit()
-
-        sub_frame = cv.absdiff(frame, bg_img)
-
-        filtered_frame = cv.inRange(sub_frame, lower_white, upper_white)
-
-        # Kernel for morphological operation opening
-        kernel3 = cv.getStructuringElement(
-            cv.MORPH_ELLIPSE,
-            (3, 3),
-            (-1, -1)
-        )
-
-        kernel20 = cv.getStructuringElement(
-            cv.MORPH_ELLIPSE,
-            (20, 20),
-            (-1, -1)
-        )
 
-        # Morphological opening
-        mask = cv.dilate(cv.erode(filtered_frame, kernel3), kernel20)
+            if(args.save_video):
+                outWriter.release()
 
-        mask_roi = cv.bitwise_and(sub_frame, sub_frame, mask=mask)
+            exit()
 
-        # Find all the contours in the mask
-        returns = cv.findContours(mask, cv.RETR_LIST, cv.CHAIN_APPROX_NONE)
-        
-        # Check what findContours returned
-        contours = []
-        if(len(returns) == 3):
-            contours = returns[1]
-        else:
-            contours = returns[0]
+        timer.start(began)
+        timer.mark('decode')
 
-        for i, c in enumerate(contours):
-            # Calculate the area of each contour
-            area = cv.contourArea(c)
+        mask = segmenter.segment(frame)
 
-            # Ignore contours that are too small or too large
-            if area < 1e2 or 1e5 < area:
-                continue
+        # Ignore contours that are too small or too large
+        contours = segmenter.filtered_contours(1e2, 1e5)
+        timer.mark('detect')
 
+        for c in contours:
             # Draw each contour only for visualisation purposes
-            cv.drawContours(frame, contours, i, (255, 0, 255), 2)
+            cv.drawContours(frame, [c], 0, (255, 0, 255), 2)
 
             # Find the orientation of each shape
             getOrientation(c, frame, args.both_axis)
 
         if(args.color_mask):
-            # Change the color of the mask
-            colored_mask = cv.cvtColor(mask, cv.COLOR_GRAY2BGR)
-            colored_mask[np.where((colored_mask == [255, 255, 255]).all(axis = 2))] = [0, 0, 255]
+            # Apply the mask with its own color
+            segmenter.overlay_mask(frame, (0, 0, 255))
+
+        timer.mark('drawing')
+
+        if(args.save_video):
+            outWriter.write(frame)
+            timer.mark('writing')
 
-            # Apply the mask
-            frame = cv.add(frame, colored_mask)
+        if(timer.should_snapshot(args.profile_interval)):
+            print(timer.snapshot())
 
         cv.imshow(result_win, frame)
 
         if(args.show_mask):
             cv.imshow(mask_win, mask)
 
-        if(args.save_video):
-            outWriter.write(frame)
-
         key = cv.waitKey(5)
+        timer.mark('display')
         if(key == 27 or key == 113):
             cv.destroyAllWindows()
             cap.release()
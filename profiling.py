@@ -0,0 +1,158 @@
+from collections import defaultdict
+from time import perf_counter
+from os import replace
+import numpy as np
+import atexit
+import json
+import csv
+
+PERCENTILES = (50, 95, 99)
+
+class StageTimer:
+    # Time spent in each stage of the processing of a frame. start() is
+    # called when a frame begins and every mark() closes the stage that
+    # began at the previous call, so the stages need no nesting. The last
+    # `window` durations of each stage are kept for rolling percentiles.
+
+    def __init__(self, window=1000):
+        self.window = window
+
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.samples = {}
+
+        self.frames = 0
+        self.started = perf_counter()
+        self.last = self.started
+        self.last_snapshot = self.started
+
+    def now(self):
+        return perf_counter()
+
+    def start(self, began=None):
+        # A frame only counts once it was read, the time since `began`, taken
+        # with now() before reading it, goes to the next stage marked
+        self.frames += 1
+        self.last = perf_counter() if began is None else began
+
+    def mark(self, stage):
+        now = perf_counter()
+        duration = now - self.last
+
+        if(stage not in self.samples):
+            self.samples[stage] = np.empty(self.window, dtype=np.float64)
+
+        self.samples[stage][self.counts[stage] % self.window] = duration
+        self.totals[stage] += duration
+        self.counts[stage] += 1
+        self.last = now
+
+    def reset(self):
+        self.totals.clear()
+        self.counts.clear()
+        self.samples.clear()
+
+        self.frames = 0
+        self.started = perf_counter()
+        self.last = self.started
+        self.last_snapshot = self.started
+
+    def report(self):
+        # One row per stage, durations in milliseconds
+        frames = max(self.frames, 1)
+        measured = sum(self.totals.values())
+
+        rows = []
+        for stage, total in self.totals.items():
+            count = self.counts[stage]
+            recent = self.samples[stage][:min(count, self.window)]
+
+            rows.append(dict(
+                {
+                    'stage': stage,
+                    'calls': count,
+                    'total_s': total,
+                    'ms_per_frame': 1000 * total / frames,
+                    'mean_ms': 1000 * total / count,
+                    'share': total / measured if measured > 0 else 0.0
+                },
+                **{
+                    f'p{q}_ms': 1000 * value
+                    for q, value in zip(PERCENTILES, np.percentile(recent, PERCENTILES))
+                }
+            ))
+
+        return rows
+
+    def should_snapshot(self, interval):
+        return bool(interval) and perf_counter() - self.last_snapshot >= interval
+
+    def snapshot(self):
+        self.last_snapshot = perf_counter()
+        elapsed = self.last_snapshot - self.started
+
+        lines = [f'{self.frames} frames in {elapsed:.1f}s, {self.frames / max(elapsed, 1e-9):.1f} fps']
+        lines.append(f'{"stage":<12}{"ms/frame":>10}{"p50":>9}{"p95":>9}{"p99":>9}{"share":>8}')
+
+        for row in self.report():
+            lines.append(
+                f'{row["stage"]:<12}{row["ms_per_frame"]:>10.3f}'
+                f'{row["p50_ms"]:>9.3f}{row["p95_ms"]:>9.3f}{row["p99_ms"]:>9.3f}'
+                f'{row["share"]:>8.1%}'
+            )
+
+        return '\n'.join(lines)
+
+    def write(self, json_file=None, csv_file=None):
+        # Written aside and renamed so readers never see a partial report
+        rows = self.report()
+
+        if(json_file is not None):
+            with open(json_file + '.tmp', 'w') as report_file:
+                json.dump({
+                    'frames': self.frames,
+                    'elapsed_s': perf_counter() - self.started,
+                    'window': self.window,
+                    'stages': rows
+                }, report_file, indent=2)
+
+            replace(json_file + '.tmp', json_file)
+
+        if(csv_file is not None and len(rows) > 0):
+            with open(csv_file + '.tmp', 'w', newline='') as report_file:
+                writer = csv.DictWriter(report_file, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows(rows)
+
+            replace(csv_file + '.tmp', csv_file)
+
+class NullTimer:
+    # Stands in for a StageTimer when nothing is measured
+
+    def now(self):
+        return 0.0
+
+    def start(self, began=None):
+        pass
+
+    def mark(self, stage):
+        pass
+
+    def reset(self):
+        pass
+
+    def should_snapshot(self, interval):
+        return False
+
+NULL_TIMER = NullTimer()
+
+def makeTimer(enabled):
+    return StageTimer() if enabled else NULL_TIMER
+
+def reportAtExit(timer, json_file, csv_file):
+    # For the scripts that exit from several places
+    def report():
+        print(timer.snapshot())
+        timer.write(json_file, csv_file)
+
+    atexit.register(report)
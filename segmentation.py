@@ -0,0 +1,601 @@
+from utils import computeRegionOrientation
+from profiling import NULL_TIMER
+import numpy as np
+import cv2 as cv
+
+# How frames are compared with the background: every colour channel, or a
+# single channel from the grey levels or from the brightest channel
+CHANNEL_MODES = ('bgr', 'gray', 'max')
+
+# How the opening is computed:
+# ellipse  - erode and dilate with elliptical kernels of the given sizes
+# rect     - rectangular kernels, separable so their cost barely grows with the size
+# iterated - 3x3 cross and square kernels alternated, an octagon close to the ellipse
+# distance - thresholds of a distance transform, an exact disc at a cost that
+#            does not depend on the size
+MORPHOLOGY_MODES = ('ellipse', 'rect', 'iterated', 'distance')
+
+# How the detections are found in the mask:
+# contours   - every contour is traced and measured
+# components - the blobs are labelled instead, which gives the area and box
+#              of every blob without tracing them. Large masks are labelled
+#              at a reduced size first, so only the boxes of the biggest
+#              blobs are labelled at full resolution
+DETECTORS = ('contours', 'components')
+
+# Masks larger than this are labelled at 1/BLOB_SCALE of their size to find
+# their largest blob, then only the boxes of the BLOB_CANDIDATES biggest
+# reduced blobs are labelled at full resolution
+COARSE_LABEL_PIXELS = 256 * 256
+BLOB_SCALE = 4
+BLOB_CANDIDATES = 3
+
+def reduceChannels(image, mode, dst=None):
+    if(mode == 'gray'):
+        return cv.cvtColor(image, cv.COLOR_BGR2GRAY, dst=dst)
+
+    if(dst is None):
+        dst = np.empty(image.shape[:2], dtype=image.dtype)
+
+    # Element-wise over the channel views, a reduction along the last axis
+    # walks the interleaved pixels one at a time and is many times slower
+    np.maximum(image[..., 0], image[..., 1], out=dst)
+    np.maximum(dst, image[..., 2], out=dst)
+
+    return dst
+
+def findContours(image, offset=(0, 0), mode=cv.RETR_LIST):
+    returns = cv.findContours(image, mode, cv.CHAIN_APPROX_NONE, offset=offset)
+
+    # Check what findContours returned, OpenCV 3 also gives back the image
+    if(len(returns) == 3):
+        return returns[1]
+
+    return returns[0]
+
+class Segmenter:
+    # Background subtraction, thresholding and morphological opening shared
+    # by every entry point. Kernels and intermediate images are created once
+    # and reused through the dst= arguments for the whole run.
+
+    def __init__(self, bg_img, lower_white, upper_white, erode_size=3, dilate_size=20, blur=False, channels='bgr', morphology='ellipse', detector='contours'):
+        if(channels not in CHANNEL_MODES):
+            raise ValueError(f'Unknown channel mode: {channels}')
+
+        if(morphology not in MORPHOLOGY_MODES):
+            raise ValueError(f'Unknown morphology: {morphology}')
+
+        if(detector not in DETECTORS):
+            raise ValueError(f'Unknown detector: {detector}')
+
+        # With a single channel the background is kept reduced as well and
+        # every later step moves a third of the data
+        self.channels = channels
+        self.blur = blur
+        self.erode_size = erode_size
+        self.dilate_size = dilate_size
+        self.morphology = morphology
+        self.detector = detector
+
+        # Kernels for morphological operation opening
+        shape = cv.MORPH_RECT if morphology == 'rect' else cv.MORPH_ELLIPSE
+
+        self.kernel_erode = cv.getStructuringElement(
+            shape,
+            (erode_size, erode_size),
+            (-1, -1)
+        )
+
+        self.kernel_dilate = cv.getStructuringElement(
+            shape,
+            (dilate_size, dilate_size),
+            (-1, -1)
+        )
+
+        # Each 3x3 step grows or shrinks the shape by one pixel
+        self.small_kernels = (
+            cv.getStructuringElement(cv.MORPH_CROSS, (3, 3)),
+            cv.getStructuringElement(cv.MORPH_RECT, (3, 3))
+        )
+
+        # Pixel centres within these distances are covered by the kernels
+        self.erode_radius = (erode_size - 1) / 2
+        self.dilate_radius = (dilate_size - 1) / 2
+
+        # Region of the frame covered by the last mask, None for the whole frame
+        self.window = None
+        self.window_size = None
+        self.region_storage = None
+
+        # Replaced by a StageTimer to measure each step of the pipeline
+        self.timer = NULL_TIMER
+
+        # Buffers of the last segmented image and the blobs found in it.
+        # blob_scope is None until the mask is labelled, 'all' when every
+        # blob is known and 'largest' when only the largest one is
+        self.last_buffers = None
+        self.blob_scope = None
+        self.blob_stats = None
+        self.blob_centroids = None
+        self.blob_labels = None
+        self.blob_origin = (0, 0)
+        self.blob_ids = None
+
+        # Reduced mask and its labels, reallocated only when the size changes
+        self.coarse_mask = None
+        self.coarse_labels = None
+
+        self.bg_img = None
+        self.set_boundaries(lower_white, upper_white)
+        self.set_background(bg_img)
+
+    def set_boundaries(self, lower_white, upper_white):
+        self.lower_white = np.array(lower_white)
+        self.upper_white = np.array(upper_white)
+
+        # The three boundaries are the same, a single channel uses the first
+        if(self.channels == 'bgr'):
+            self.lower_bound, self.upper_bound = self.lower_white, self.upper_white
+        else:
+            self.lower_bound = float(np.ravel(self.lower_white)[0])
+            self.upper_bound = float(np.ravel(self.upper_white)[0])
+
+    def set_background(self, bg_img):
+        if(self.channels != 'bgr' and bg_img.ndim == 3):
+            bg_img = reduceChannels(
+                bg_img, self.channels,
+                self.bg_img if self.bg_img is not None and self.bg_img.shape == bg_img.shape[:2] else None
+            )
+
+        reallocate = self.bg_img is None or self.bg_img.shape != bg_img.shape
+
+        self.bg_img = np.ascontiguousarray(bg_img)
+
+        if(reallocate):
+            self.buffers = self._allocate(bg_img.shape)
+            self.mask = self.buffers['mask']
+            self.region_storage = None
+
+            if(self.window_size is not None):
+                self.set_window_size(max(self.window_size))
+
+    def set_window_size(self, size):
+        height, width = self.bg_img.shape[:2]
+
+        self.window_size = (min(size, width), min(size, height))
+
+        # Allocates the region buffers up front for windows of this size
+        self._region_buffers(*self.window_size)
+
+    def _allocate(self, shape):
+        height, width = shape[:2]
+
+        return {
+            'reduced': np.empty((height, width), dtype=np.uint8),
+            'sub': np.empty(shape, dtype=np.uint8),
+            'blurred': np.empty(shape, dtype=np.uint8),
+            'filtered': np.empty((height, width), dtype=np.uint8),
+            'eroded': np.empty((height, width), dtype=np.uint8),
+            'inverted': np.empty((height, width), dtype=np.uint8),
+            'distance': np.empty((height, width), dtype=np.float32),
+            'labels': np.empty((height, width), dtype=np.int32),
+            'mask': np.empty((height, width), dtype=np.uint8)
+        }
+
+    def _region_buffers(self, width, height):
+        # Buffers for a region of the frame are the beginning of flat arrays
+        # reshaped to the region size, so they stay contiguous for the dst=
+        # arguments and are only reallocated when a bigger region shows up
+        channels = self.bg_img.shape[2:]
+        pixels = width * height
+        colour_pixels = pixels * int(np.prod(channels))
+
+        if(self.region_storage is None or self.region_storage['mask'].size < pixels):
+            self.region_storage = {
+                'reduced': np.empty(pixels, dtype=np.uint8),
+                'sub': np.empty(colour_pixels, dtype=np.uint8),
+                'blurred': np.empty(colour_pixels, dtype=np.uint8),
+                'filtered': np.empty(pixels, dtype=np.uint8),
+                'eroded': np.empty(pixels, dtype=np.uint8),
+                'inverted': np.empty(pixels, dtype=np.uint8),
+                'distance': np.empty(pixels, dtype=np.float32),
+                'labels': np.empty(pixels, dtype=np.int32),
+                'mask': np.empty(pixels, dtype=np.uint8)
+            }
+
+        storage = self.region_storage
+
+        return {
+            'reduced': storage['reduced'][:pixels].reshape(height, width),
+            'sub': storage['sub'][:colour_pixels].reshape((height, width) + channels),
+            'blurred': storage['blurred'][:colour_pixels].reshape((height, width) + channels),
+            'filtered': storage['filtered'][:pixels].reshape(height, width),
+            'eroded': storage['eroded'][:pixels].reshape(height, width),
+            'inverted': storage['inverted'][:pixels].reshape(height, width),
+            'distance': storage['distance'][:pixels].reshape(height, width),
+            'labels': storage['labels'][:pixels].reshape(height, width),
+            'mask': storage['mask'][:pixels].reshape(height, width)
+        }
+
+    def _pipeline(self, frame, bg_img, buffers):
+        timer = self.timer
+
+        if(self.channels != 'bgr'):
+            frame = reduceChannels(frame, self.channels, buffers['reduced'])
+            timer.mark('reduce')
+
+        cv.absdiff(frame, bg_img, dst=buffers['sub'])
+        timer.mark('subtract')
+
+        if(self.blur):
+            cv.GaussianBlur(buffers['sub'], (5, 5), 0, dst=buffers['blurred'])
+            cv.medianBlur(buffers['blurred'], 5, dst=buffers['sub'])
+            timer.mark('blur')
+
+        cv.inRange(buffers['sub'], self.lower_bound, self.upper_bound, dst=buffers['filtered'])
+        timer.mark('threshold')
+
+        self._opening(buffers)
+        timer.mark('opening')
+
+        self.last_buffers = buffers
+        self.blob_scope = None
+
+        return buffers['mask']
+
+    def _opening(self, buffers):
+        # Morphological opening of the filtered image into the mask
+        if(self.morphology == 'iterated'):
+            self._iterate(cv.erode, buffers['filtered'], buffers['eroded'], self.erode_size // 2)
+            self._iterate(cv.dilate, buffers['eroded'], buffers['mask'], self.dilate_size // 2)
+
+        elif(self.morphology == 'distance'):
+            # Distance of each pixel to the closest background pixel, the ones
+            # further than the radius survive the erosion
+            cv.distanceTransform(buffers['filtered'], cv.DIST_L2, cv.DIST_MASK_PRECISE, buffers['distance'])
+            cv.compare(buffers['distance'], self.erode_radius, cv.CMP_GT, dst=buffers['eroded'])
+
+            # and the pixels close enough to an eroded one are set by the dilation
+            cv.bitwise_not(buffers['eroded'], dst=buffers['inverted'])
+            cv.distanceTransform(buffers['inverted'], cv.DIST_L2, cv.DIST_MASK_PRECISE, buffers['distance'])
+            cv.compare(buffers['distance'], self.dilate_radius, cv.CMP_LE, dst=buffers['mask'])
+
+        else:
+            cv.erode(buffers['filtered'], self.kernel_erode, dst=buffers['eroded'])
+            cv.dilate(buffers['eroded'], self.kernel_dilate, dst=buffers['mask'])
+
+    def _iterate(self, operation, src, dst, steps):
+        if(steps == 0):
+            np.copyto(dst, src)
+            return
+
+        for step in range(steps):
+            operation(src if step == 0 else dst, self.small_kernels[step % 2], dst=dst)
+
+    def segment(self, frame):
+        self.window = None
+
+        return self._pipeline(frame, self.bg_img, self.buffers)
+
+    def segment_window(self, frame, center):
+        # Segments only a window around center, kept inside the frame
+        height, width = frame.shape[:2]
+        w, h = self.window_size
+
+        x = int(min(max(center[0] - w // 2, 0), width - w))
+        y = int(min(max(center[1] - h // 2, 0), height - h))
+
+        return self.segment_region(frame, (x, y, w, h))
+
+    def segment_region(self, frame, rect):
+        # Segments only the given (x, y, w, h) region, clipped to the frame
+        height, width = frame.shape[:2]
+        x, y, w, h = rect
+
+        x, y = max(int(x), 0), max(int(y), 0)
+        w, h = min(int(w), width - x), min(int(h), height - y)
+
+        buffers = self._region_buffers(w, h)
+
+        self.window = (x, y, w, h)
+        self.window_mask = buffers['mask']
+
+        return self._pipeline(frame[y:y+h, x:x+w], self.bg_img[y:y+h, x:x+w], buffers)
+
+    def touches_window_edge(self, contour):
+        # Whether the detection may continue outside the last window
+        if(self.window is None):
+            return False
+
+        x, y, w, h = self.window
+        height, width = self.bg_img.shape[:2]
+        cx, cy, cw, ch = cv.boundingRect(contour)
+
+        return (
+            (cx <= x and x > 0) or (cy <= y and y > 0) or
+            (cx + cw >= x + w and x + w < width) or
+            (cy + ch >= y + h and y + h < height)
+        )
+
+    def contours(self):
+        # Find all the contours in the last computed mask, in frame coordinates
+        if(self.window is not None):
+            return findContours(self.window_mask, (self.window[0], self.window[1]))
+
+        return findContours(self.mask)
+
+    def _set_blobs(self, scope, labels, origin, stats, centroids, ids):
+        # Boxes and centroids are kept in frame coordinates
+        self.blob_scope = scope
+        self.blob_labels = labels
+        self.blob_origin = origin
+        self.blob_ids = ids
+
+        self.blob_stats = stats.copy()
+        self.blob_centroids = centroids.copy()
+
+        self.blob_stats[:, :2] += origin
+        self.blob_centroids += origin
+
+    def _mask_origin(self):
+        return (self.window[0], self.window[1]) if self.window is not None else (0, 0)
+
+    def blobs(self, min_area=0, max_area=np.inf):
+        # Labels the whole last computed mask once and returns the indexes of
+        # the blobs within the area limits. Their boxes (x, y, w, h, area) and
+        # centroids are kept in blob_stats and blob_centroids
+        if(self.blob_scope != 'all'):
+            buffers = self.last_buffers
+
+            count, _, stats, centroids = cv.connectedComponentsWithStats(
+                buffers['mask'], labels=buffers['labels'], connectivity=8, ltype=cv.CV_32S
+            )
+
+            # Label 0 is the background
+            self._set_blobs(
+                'all', buffers['labels'], self._mask_origin(),
+                stats[1:], centroids[1:], np.arange(1, count)
+            )
+
+        areas = self.blob_stats[:, cv.CC_STAT_AREA]
+
+        return np.flatnonzero((areas >= min_area) & (areas <= max_area))
+
+    def _label_largest(self, mask):
+        # Labelling visits every pixel and costs far more than tracing a
+        # clean mask, so the mask is labelled at a reduced size, where no
+        # blob disappears since any set pixel keeps its reduced cell set,
+        # and only the boxes of the biggest reduced blobs at full resolution
+        height, width = mask.shape
+        size = (max(width // BLOB_SCALE, 1), max(height // BLOB_SCALE, 1))
+
+        self.coarse_mask = cv.resize(mask, size, dst=self.coarse_mask, interpolation=cv.INTER_AREA)
+
+        _, self.coarse_labels, stats, _ = cv.connectedComponentsWithStats(
+            self.coarse_mask, labels=self.coarse_labels, connectivity=8, ltype=cv.CV_32S
+        )
+
+        stats = stats[1:]
+        scale_x, scale_y = width / size[0], height / size[1]
+
+        best = None
+
+        for candidate in np.argsort(stats[:, cv.CC_STAT_AREA])[::-1][:BLOB_CANDIDATES]:
+            x, y, w, h = stats[candidate, :4]
+
+            # One more cell on each side for the rounding of the reduction
+            x0, y0 = max(int((x - 1) * scale_x), 0), max(int((y - 1) * scale_y), 0)
+            x1 = min(int(np.ceil((x + w + 1) * scale_x)), width)
+            y1 = min(int(np.ceil((y + h + 1) * scale_y)), height)
+
+            _, labels, box_stats, box_centroids = cv.connectedComponentsWithStats(
+                mask[y0:y1, x0:x1], connectivity=8, ltype=cv.CV_32S
+            )
+
+            if(len(box_stats) < 2):
+                continue
+
+            label = 1 + int(np.argmax(box_stats[1:, cv.CC_STAT_AREA]))
+
+            if(best is None or box_stats[label, cv.CC_STAT_AREA] > best[2][0, cv.CC_STAT_AREA]):
+                best = (labels, (x0, y0), box_stats[label:label+1], box_centroids[label:label+1], label)
+
+        if(best is None):
+            self._set_blobs(
+                'largest', None, (0, 0),
+                np.empty((0, 5), dtype=np.int32), np.empty((0, 2)), np.empty(0, dtype=np.int64)
+            )
+            return
+
+        labels, (x0, y0), stats, centroids, label = best
+        ox, oy = self._mask_origin()
+
+        self._set_blobs('largest', labels, (ox + x0, oy + y0), stats, centroids, np.array([label]))
+
+    def largest_blob(self):
+        if(self.blob_scope is None):
+            mask = self.last_buffers['mask']
+
+            if(mask.size > COARSE_LABEL_PIXELS):
+                self._label_largest(mask)
+            else:
+                self.blobs()
+
+        if(len(self.blob_stats) == 0):
+            return None
+
+        return int(np.argmax(self.blob_stats[:, cv.CC_STAT_AREA]))
+
+    def blob_area(self, index):
+        return int(self.blob_stats[index, cv.CC_STAT_AREA])
+
+    def blob_mask(self, index):
+        # Mask of a single blob cropped to its box, and where the box starts
+        x, y, w, h = self.blob_stats[index, :4]
+        ox, oy = self.blob_origin
+
+        labels = self.blob_labels[y-oy:y-oy+h, x-ox:x-ox+w]
+
+        return cv.compare(labels, int(self.blob_ids[index]), cv.CMP_EQ), (int(x), int(y))
+
+    def blob_contour(self, index):
+        mask, offset = self.blob_mask(index)
+
+        # A single blob has a single outer contour
+        return findContours(mask, offset, cv.RETR_EXTERNAL)[0]
+
+    def blob_orientation(self, index):
+        return computeRegionOrientation(*self.blob_mask(index))
+
+    def largest_contour(self):
+        if(self.detector == 'components'):
+            index = self.largest_blob()
+            return self.blob_contour(index) if index is not None else None
+
+        contours = self.contours()
+
+        if(len(contours) == 0):
+            return None
+
+        # find the biggest countour by the area
+        return max(contours, key = cv.contourArea)
+
+    def filtered_contours(self, min_area=1e2, max_area=1e5):
+        # Ignore contours that are too small or too large
+        if(self.detector == 'components'):
+            return [ self.blob_contour(index) for index in self.blobs(min_area, max_area) ]
+
+        return [
+            c for c in self.contours()
+            if min_area <= cv.contourArea(c) <= max_area
+        ]
+
+    def overlay_mask(self, frame, colour):
+        # Paints the detection over the frame in place, same as adding a
+        # coloured copy of the mask but without building one every frame
+        if(self.window is None):
+            cv.add(frame, (*colour, 0), dst=frame, mask=self.mask)
+            return frame
+
+        x, y, w, h = self.window
+        crop = frame[y:y+h, x:x+w]
+
+        coloured = cv.add(crop, (*colour, 0), mask=self.window_mask)
+        np.copyto(crop, coloured, where=self.window_mask[..., None] > 0)
+
+        return frame
+
+class SearchWindow:
+    # Segments only a window around where the animal is expected to be,
+    # predicted from its last position and velocity. The whole frame is
+    # searched again when the animal is lost or reaches the window edge.
+
+    def __init__(self, segmenter, size):
+        self.segmenter = segmenter
+        self.segmenter.set_window_size(size)
+
+        self.previous = None
+        self.current = None
+
+        self.frames = 0
+        self.full_searches = 0
+
+    def largest_contour(self, frame):
+        self.frames += 1
+        contour = None
+
+        if(self.current is not None):
+            # Constant velocity prediction
+            predicted = (
+                2 * self.current[0] - self.previous[0],
+                2 * self.current[1] - self.previous[1]
+            )
+
+            self.segmenter.segment_window(frame, predicted)
+            contour = self.segmenter.largest_contour()
+
+            if(contour is not None and self.segmenter.touches_window_edge(contour)):
+                contour = None
+
+        if(contour is None):
+            self.full_searches += 1
+
+            self.segmenter.segment(frame)
+            contour = self.segmenter.largest_contour()
+
+        if(contour is None):
+            self.previous = self.current = None
+            return None
+
+        x, y, w, h = cv.boundingRect(contour)
+        center = (x + w // 2, y + h // 2)
+
+        self.previous = self.current if self.current is not None else center
+        self.current = center
+
+        return contour
+
+class CoarseToFine:
+    # Finds the animal on a downscaled copy of the frame, where background
+    # subtraction, thresholding and the opening are much cheaper, then
+    # segments again at full resolution only inside its bounding box so the
+    # contour and its orientation keep their full precision.
+
+    def __init__(self, segmenter, scale):
+        self.segmenter = segmenter
+        self.scale = scale
+
+        height, width = segmenter.bg_img.shape[:2]
+        self.coarse_size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+
+        self.coarse_bg = cv.resize(segmenter.bg_img, self.coarse_size, interpolation=cv.INTER_AREA)
+        self.coarse_frame = None
+
+        # Kernels scaled to match the smaller image
+        self.coarse = Segmenter(
+            self.coarse_bg, segmenter.lower_white, segmenter.upper_white,
+            erode_size=max(int(round(segmenter.erode_size * scale)), 1),
+            dilate_size=max(int(round(segmenter.dilate_size * scale)), 1),
+            blur=segmenter.blur, channels=segmenter.channels,
+            morphology=segmenter.morphology, detector=segmenter.detector
+        )
+
+        # Room around the coarse box for what the downscaling may have missed
+        self.margin = segmenter.dilate_size + int(np.ceil(1 / scale))
+
+    def set_background(self, bg_img):
+        # Called whenever the background of the main segmenter changes, the
+        # coarse level would otherwise keep comparing with the first one
+        self.coarse_bg = cv.resize(bg_img, self.coarse_size, dst=self.coarse_bg, interpolation=cv.INTER_AREA)
+        self.coarse.set_background(self.coarse_bg)
+
+    def largest_contour(self, frame):
+        # Follows the boundaries if they were changed on the main segmenter
+        # set_boundaries copies them, so they are compared by value
+        if(not np.array_equal(self.coarse.lower_white, self.segmenter.lower_white) or not np.array_equal(self.coarse.upper_white, self.segmenter.upper_white)):
+            self.coarse.set_boundaries(self.segmenter.lower_white, self.segmenter.upper_white)
+
+        # Allocated on the first frame, when its number of channels is known
+        self.coarse_frame = cv.resize(frame, self.coarse_size, dst=self.coarse_frame, interpolation=cv.INTER_AREA)
+
+        self.coarse.segment(self.coarse_frame)
+        coarse_contour = self.coarse.largest_contour()
+        self.segmenter.timer.mark('coarse')
+
+        if(coarse_contour is None):
+            return None
+
+        x, y, w, h = cv.boundingRect(coarse_contour)
+
+        self.segmenter.segment_region(frame, (
+            x / self.scale - self.margin, y / self.scale - self.margin,
+            w / self.scale + 2 * self.margin, h / self.scale + 2 * self.margin
+        ))
+
+        contour = self.segmenter.largest_contour()
+
+        if(contour is None):
+            # Nothing survived at full resolution, the coarse contour scaled up
+            return (coarse_contour / self.scale).astype(np.int32)
+
+        return contour
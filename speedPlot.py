@@ -1,7 +1,10 @@
 from matplotlib import pyplot as plt
 from pandas import read_csv
+import numpy as np
 import argparse
 
+DECIMATIONS = ('minmax', 'lttb', 'none')
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description='Processes a log of speed detections and produces a plot.'
@@ -12,37 +15,145 @@ def parse_args():
         help='Path to the speed log file'
     )
 
+    parser.add_argument(
+        '--max-speed', type=float, default=1000,
+        help='Speeds from this value up are taken as tracking errors and left out.'
+    )
+
+    parser.add_argument(
+        '--decimate', type=str, default='minmax', choices=DECIMATIONS,
+        help='How the samples are reduced for drawing: the lowest and highest of each pixel (minmax), largest triangle three buckets (lttb) or every sample (none).'
+    )
+
+    parser.add_argument(
+        '--points', type=int, default=4000,
+        help='Samples drawn at most when decimating.'
+    )
+
+    parser.add_argument(
+        '--rolling', type=float, default=0,
+        help='Also draws the rolling mean and median over windows of this many seconds.'
+    )
+
     return parser.parse_args()
 
+def minMaxDecimate(values, points):
+    # Indices of the lowest and highest sample of each bucket, in time
+    # order, so every spike is still drawn
+    buckets = max(points // 2, 1)
+
+    if(len(values) <= 2 * buckets):
+        return np.arange(len(values))
+
+    size = int(np.ceil(len(values) / buckets))
+
+    # The last bucket is padded with its last value
+    padded = np.empty(buckets * size, dtype=values.dtype)
+    padded[:len(values)] = values
+    padded[len(values):] = values[-1]
+    padded = padded.reshape(buckets, size)
+
+    offsets = np.arange(buckets) * size
+    indices = np.concatenate((
+        offsets + padded.argmin(axis=1),
+        offsets + padded.argmax(axis=1)
+    ))
+
+    return np.unique(np.minimum(indices, len(values) - 1))
+
+def lttbDecimate(times, values, points):
+    # Largest triangle three buckets: from each bucket the sample forming
+    # the largest triangle with the one kept before it and the mean of the
+    # next bucket, which keeps the shape of the series and its peaks
+    if(len(values) <= points or points < 3):
+        return np.arange(len(values))
+
+    # First and last samples are always kept
+    edges = np.linspace(1, len(values) - 1, points - 1).astype(int)
+
+    indices = np.empty(points, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = len(values) - 1
+
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+
+        if(bucket + 2 < len(edges)):
+            next_start, next_end = end, edges[bucket + 2]
+        else:
+            next_start, next_end = len(values) - 1, len(values)
+
+        next_time = times[next_start:next_end].mean()
+        next_value = values[next_start:next_end].mean()
+
+        previous = indices[bucket]
+
+        area = np.abs(
+            (times[previous] - next_time) * (values[start:end] - values[previous]) -
+            (times[previous] - times[start:end]) * (next_value - values[previous])
+        )
+
+        indices[bucket + 1] = start + area.argmax()
+
+    return indices
+
+def decimate(times, values, method, points):
+    if(method == 'minmax'):
+        return minMaxDecimate(values, points)
+
+    if(method == 'lttb'):
+        return lttbDecimate(times, values, points)
+
+    return np.arange(len(values))
+
 if __name__ == '__main__':
     args = parse_args()
 
     data = read_csv(args.log_file)
 
+    # Tracking errors left out once, the statistics use every other sample
+    data = data[data.speed < args.max_speed]
+
+    times = data.time.to_numpy()
+    speeds = data.speed.to_numpy()
+
+    mean = speeds.mean()
+    median = np.median(speeds)
+
     fig, axes = plt.subplots(ncols=1, nrows=1, figsize=(12, 5))
-    
+
     axes.set(
-        title='Speed of the animal during the video', 
+        title='Speed of the animal during the video',
         xlabel='Time (s)',
         ylabel='Speed ($Pixel * s^{-1}$)'
     )
 
-    #axes.plot(data.time, data.speed)
-    axes.plot(data.query('speed < 1000').time, data.query('speed < 1000').speed)
+    shown = decimate(times, speeds, args.decimate, args.points)
+    axes.plot(times[shown], speeds[shown])
+
+    if(args.rolling > 0 and len(times) > 1):
+        # Window in samples from the usual time between them
+        window = max(int(round(args.rolling / np.median(np.diff(times)))), 1)
+        rolling = data.speed.rolling(window, center=True, min_periods=1)
+
+        for statistic, color in ((rolling.mean(), 'tab:red'), (rolling.median(), 'tab:green')):
+            values = statistic.to_numpy()
+            shown = decimate(times, values, args.decimate, args.points)
 
-    mean = data.query("speed < 1000").speed.mean()
-    median = data.query("speed < 1000").speed.median() 
+            axes.plot(times[shown], values[shown], color=color, linewidth=1.5)
+
+        axes.legend(['Speed', f'Rolling mean ({args.rolling:g}s)', f'Rolling median ({args.rolling:g}s)'], loc='upper left')
 
     axes.text(
-        0.87, 0.95, f'Mean: {mean:.3f}\nMedian: {median:.3f}', 
+        0.87, 0.95, f'Mean: {mean:.3f}\nMedian: {median:.3f}',
         transform = axes.transAxes, fontsize=10,
-        verticalalignment='top', 
+        verticalalignment='top',
         bbox={
-            'boxstyle': 'round', 
-            'facecolor': 'wheat', 
+            'boxstyle': 'round',
+            'facecolor': 'wheat',
             'alpha': 0.5
         }
     )
-    
+
     plt.tight_layout()
     plt.show()
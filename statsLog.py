@@ -0,0 +1,86 @@
+from time import perf_counter
+from os import replace
+import json
+
+class StatsAccumulator:
+    # Keeps the traveled distance and, for each region, the frames spent
+    # inside, how many times the animal entered it and the distance covered
+    # there. The report files are only written from time to time
+
+    def __init__(self, rois, frame_rate, flush_every=0, flush_interval=10.0):
+        self.rois = rois
+        self.frame_rate = frame_rate
+
+        self.frames = 0
+        self.traveled_distance = 0
+
+        self.dwell_frames = [ 0 for _ in range(len(rois)) ]
+        self.entries = [ 0 for _ in range(len(rois)) ]
+        self.distance = [ 0 for _ in range(len(rois)) ]
+        self.was_inside = [ False for _ in range(len(rois)) ]
+
+        # Snapshot every N frames and/or every few seconds, 0 or None disables
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.last_flush = perf_counter()
+
+    def update(self, speed, inside):
+        self.frames += 1
+        self.traveled_distance += speed
+
+        for index, is_inside in enumerate(inside):
+            if(is_inside):
+                self.dwell_frames[index] += 1
+                self.distance[index] += speed
+
+                if(not self.was_inside[index]):
+                    self.entries[index] += 1
+
+            self.was_inside[index] = is_inside
+
+    def should_flush(self):
+        if(self.flush_every and self.frames % self.flush_every == 0):
+            return True
+
+        return bool(self.flush_interval) and perf_counter() - self.last_flush >= self.flush_interval
+
+    def snapshot(self):
+        return {
+            'frame_rate': self.frame_rate,
+            'frames': self.frames,
+            'traveled_distance': float(self.traveled_distance),
+            'regions': [
+                {
+                    'roi': list(self.rois[index]),
+                    'frames': self.dwell_frames[index],
+                    'seconds': self.dwell_frames[index] * (1/float(self.frame_rate)),
+                    'entries': self.entries[index],
+                    'distance': float(self.distance[index])
+                }
+                for index in range(len(self.rois))
+            ]
+        }
+
+    def write(self, text_file, json_file=None):
+        # Written aside and renamed so readers never see a partial report
+        with open(text_file + '.tmp', 'w') as log_file:
+            log_file.write(f'\tCounters for the regions considering {self.frame_rate}fps video\n')
+            log_file.write(f'\n- Processed frames: {self.frames}\n')
+            log_file.write(f'\n- Traveled distance: {self.traveled_distance:.3f} pixels\n')
+
+            log_file.write('\n- Time in spent in each region:\n')
+            for idx, frames in enumerate(self.dwell_frames):
+                log_file.write(f'\tRegion {idx}:\t{frames} frames')
+                log_file.write(f', {frames * (1/float(self.frame_rate)):.3f}s')
+                log_file.write(f', {self.entries[idx]} entries')
+                log_file.write(f', {self.distance[idx]:.3f} pixels\n')
+
+        replace(text_file + '.tmp', text_file)
+
+        if(json_file is not None):
+            with open(json_file + '.tmp', 'w') as log_file:
+                json.dump(self.snapshot(), log_file, indent=2)
+
+            replace(json_file + '.tmp', json_file)
+
+        self.last_flush = perf_counter()
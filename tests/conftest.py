@@ -0,0 +1,5 @@
+import sys
+import os
+
+# The scripts are modules at the root of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
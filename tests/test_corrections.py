@@ -0,0 +1,67 @@
+from corrections import CorrectionJournal, loadPositions, compactLog, flipY, journalPath
+from os import path
+
+FRAME_HEIGHT = 480
+
+def writeLog(tmp_path):
+    # Bottom left origin, as exportCsv writes the tracker's logs
+    log_file = str(tmp_path / 'session_pos.csv')
+
+    with open(log_file, 'w') as file:
+        file.write('frame,x,y\n2,100,380\n3,110,370\n5,120,360\n')
+
+    return log_file
+
+def correct(log_file, frame, clicked):
+    # What detectionsAnalyser.py does with a point clicked on the frame
+    journal = CorrectionJournal(log_file)
+    journal.append(frame, *flipY(clicked, FRAME_HEIGHT))
+    journal.close()
+
+def test_correction_round_trip(tmp_path):
+    log_file = writeLog(tmp_path)
+    correct(log_file, 3, (200, 150))
+
+    frames, x, y = loadPositions(log_file)
+
+    assert list(frames) == [2, 3, 5]
+    assert (x[1], y[1]) == (200, 330)
+    assert flipY((x[1], y[1]), FRAME_HEIGHT) == (200, 150)
+
+    # The other rows are untouched
+    assert (x[0], y[0]) == (100, 380)
+    assert (x[2], y[2]) == (120, 360)
+
+def test_correction_of_missing_frame(tmp_path):
+    log_file = writeLog(tmp_path)
+    correct(log_file, 4, (50, 100))
+
+    frames, x, y = loadPositions(log_file)
+
+    assert list(frames) == [2, 3, 4, 5]
+    assert flipY((x[2], y[2]), FRAME_HEIGHT) == (50, 100)
+
+def test_compaction_keeps_corrections(tmp_path):
+    log_file = writeLog(tmp_path)
+    correct(log_file, 3, (200, 150))
+
+    before = loadPositions(log_file)
+    assert compactLog(log_file) == 1
+    after = loadPositions(log_file)
+
+    assert not path.isfile(journalPath(log_file))
+
+    for expected, actual in zip(before, after):
+        assert list(expected) == list(actual)
+
+def test_compaction_is_lossless(tmp_path):
+    log_file = writeLog(tmp_path)
+
+    journal = CorrectionJournal(log_file)
+    journal.append(3, 1234.5678, 987.654321)
+    journal.close()
+
+    compactLog(log_file)
+    _, x, y = loadPositions(log_file)
+
+    assert (x[1], y[1]) == (1234.5678, 987.654321)
@@ -1,11 +1,20 @@
-from utils import getOrientation
-from os import path, mkdir
+from utils import computeOrientation, drawOrientation
+from trajectoryLog import TrajectoryWriter, exportCsv
+from segmentation import Segmenter, SearchWindow, CoarseToFine
+from background import cachedBackground, RunningBackground
+from frameSource import FrameSource
+from videoWriter import AsyncVideoWriter
+from statsLog import StatsAccumulator
+from profiling import makeTimer
+from multiprocessing import Pool
+from os import path, mkdir, cpu_count
+from time import perf_counter
 from tqdm import tqdm
 import numpy as np
 import cv2 as cv
 import argparse
 
-def parser_args():
+def parser_args(argv=None):
     parser = argparse.ArgumentParser(
         description='Tracks mice.'
     )
@@ -45,243 +54,600 @@ def parser_args():
         help='Logs the speed of the center of mass to file.'
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        '--log-stats', action='store_true',
+        help='Logs the traveled distance and the time spent in each region to file.'
+    )
 
-if __name__ == '__main__':
-    args = parser_args()
+    parser.add_argument(
+        '--fsync-interval', type=float, default=5.0,
+        help='Seconds between forcing the position and speed logs to the disk.'
+    )
+
+    parser.add_argument(
+        '--stats-interval', type=float, default=10.0,
+        help='Seconds between snapshots of the statistics file, 0 disables them.'
+    )
+
+    parser.add_argument(
+        '--stats-every', type=int, default=0,
+        help='Also writes a snapshot of the statistics file every N frames.'
+    )
+
+    parser.add_argument(
+        '--background', type=str, default='first', choices=['first', 'median'],
+        help='Background from the first frame or from the median of frames spread over the video.'
+    )
+
+    parser.add_argument(
+        '--bg-samples', type=int, default=45,
+        help='Number of frames used by the median background.'
+    )
+
+    parser.add_argument(
+        '--adaptive-bg', type=float, default=0,
+        help='Rate of a running average that follows lighting drift, 0 keeps the background fixed.'
+    )
+
+    parser.add_argument(
+        '--lower-boundary', type=int, default=100,
+        help='Lower boundary of the mice color in the subtracted image.'
+    )
+
+    parser.add_argument(
+        '--upper-boundary', type=int, default=160,
+        help='Upper boundary of the mice color in the subtracted image.'
+    )
+
+    parser.add_argument(
+        '--channels', type=str, default='bgr', choices=['bgr', 'gray', 'max'],
+        help='Compares every colour channel with the background, or only the grey levels\
+        or the brightest channel, about three times less work per frame.'
+    )
+
+    parser.add_argument(
+        '--morphology', type=str, default='ellipse', choices=['ellipse', 'rect', 'iterated', 'distance'],
+        help='How the opening is computed, see compareMorphology.py for their cost and accuracy.'
+    )
+
+    parser.add_argument(
+        '--detector', type=str, default='contours', choices=['contours', 'components'],
+        help='Traces every contour of the mask (best on clean masks), or labels its blobs, large masks at a reduced size first, and traces only the chosen ones (best on masks cluttered with many small blobs).'
+    )
+
+    parser.add_argument(
+        '--headless', action='store_true',
+        help='Processes the video at full speed without opening any window.'
+    )
+
+    parser.add_argument(
+        '--rois', type=str, default=None,
+        help='Regions of interest as "x,y,w,h;x,y,w,h" instead of selecting them.'
+    )
+
+    parser.add_argument(
+        '--rois-file', type=str, default=None,
+        help='File with one "x,y,w,h" region of interest per line.'
+    )
+
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Splits the video in chunks processed by this many processes, 0 uses every core.'
+    )
+
+    parser.add_argument(
+        '--search-window', type=int, default=0,
+        help='Segments only a window of this size around the last detection, 0 searches the whole frame.'
+    )
+
+    parser.add_argument(
+        '--pyramid-scale', type=float, default=1.0,
+        help='Finds the animal at this downscale (e.g. 0.5 or 0.25) and refines it at full resolution.'
+    )
+
+    parser.add_argument(
+        '--report-drift', action='store_true',
+        help='Reports how far the search window or pyramid results are from the full resolution ones.'
+    )
+
+    parser.add_argument(
+        '--writer-queue', type=int, default=16,
+        help='Number of frames waiting to be encoded when saving the video.'
+    )
+
+    parser.add_argument(
+        '--writer-policy', type=str, default='block', choices=['block', 'drop'],
+        help='Whether to wait for the encoder or drop the frame when the queue is full.'
+    )
+
+    parser.add_argument(
+        '--prefetch', type=int, default=8,
+        help='Number of frames decoded ahead on a background thread, 0 disables it.'
+    )
+
+    parser.add_argument(
+        '--no-progress', action='store_true',
+        help='Hides the progress bar.'
+    )
+
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='Measures the time spent in each stage and writes a report to ./logs/<video>_profile.json and .csv.'
+    )
+
+    parser.add_argument(
+        '--profile-interval', type=float, default=30.0,
+        help='Seconds between the profiling snapshots printed while running, 0 prints only the final one.'
+    )
+
+    return parser.parse_args(argv)
+
+def parseRois(text):
+    rois = []
+
+    for roi in text.replace('\n', ';').split(';'):
+        if(roi.strip() == ''):
+            continue
+
+        x, y, w, h = [ int(float(value)) for value in roi.split(',') ]
+        rois.append((x, y, w, h))
+
+    return rois
+
+def loadRois(args, frame):
+    if(args.rois is not None):
+        return parseRois(args.rois)
+
+    if(args.rois_file is not None):
+        with open(args.rois_file, 'r') as rois_file:
+            return parseRois(rois_file.read())
+
+    if(args.headless):
+        return []
+
+    roi_win = 'ROI Selection'
+    cv.namedWindow(roi_win, cv.WINDOW_KEEPRATIO)
+    cv.resizeWindow(roi_win, 1438, 896)
+
+    rois = cv.selectROIs(roi_win, frame, False)
+    cv.destroyWindow(roi_win)
+
+    return [ tuple(int(value) for value in roi) for roi in rois ]
+
+def drawRois(frame, rois, rois_counter, inside):
+    for index, (x, y, w, h) in enumerate(rois):
+        # Highlights the regions where the mice is
+        cv.rectangle(
+            frame, (x, y),
+            (x + w, y + h),
+            (128, 244, 66) if inside[index] else (80, 80, 80), 2
+        )
+
+        cv.putText(
+            frame, f'{index}: {rois_counter[index]}', (x, y - 5),
+            cv.FONT_HERSHEY_COMPLEX,
+            0.5, (255, 255, 255)
+        )
+
+def makeFinder(segmenter, search_window, pyramid_scale):
+    # Strategies that avoid segmenting the whole frame at full resolution
+    if(search_window > 0):
+        return SearchWindow(segmenter, search_window)
+
+    if(0 < pyramid_scale < 1):
+        return CoarseToFine(segmenter, pyramid_scale)
+
+    return None
+
+def detect(segmenter, frame, finder=None, with_contour=True):
+    if(finder is None and segmenter.detector == 'components'):
+        segmenter.segment(frame)
+        index = segmenter.largest_blob()
+
+        # Orientation from the blob pixels, its contour is only traced to be drawn
+        contour = segmenter.blob_contour(index) if with_contour and index is not None else None
+        segmenter.timer.mark('detect')
+
+        if(index is None):
+            return None, None, 0
+
+        orientation = segmenter.blob_orientation(index)
+        segmenter.timer.mark('orientation')
+
+        return contour, orientation, segmenter.blob_area(index)
+
+    if(finder is not None):
+        contour = finder.largest_contour(frame)
+    else:
+        segmenter.segment(frame)
+
+        # find the biggest countour by the area
+        contour = segmenter.largest_contour()
+
+    segmenter.timer.mark('detect')
+
+    if(contour is None):
+        return None, None, 0
+
+    # Find the orientation of the shape
+    orientation = computeOrientation(contour)
+    segmenter.timer.mark('orientation')
+
+    return contour, orientation, cv.contourArea(contour)
+
+class DriftReport:
+    # How far the centroids and angles found by a faster strategy are from
+    # the ones of the full resolution search over the whole frame
+
+    def __init__(self):
+        self.distances = []
+        self.angles = []
+        self.disagreements = 0
+
+    def add(self, orientation, reference):
+        if((orientation is None) != (reference is None)):
+            self.disagreements += 1
+
+        if(orientation is None or reference is None):
+            return
+
+        (x, y), _, _, angle = orientation
+        (ref_x, ref_y), _, _, ref_angle = reference
+
+        self.distances.append(np.hypot(x - ref_x, y - ref_y))
+
+        # The axis has no direction, angles are compared modulo pi
+        difference = (angle - ref_angle + np.pi / 2) % np.pi - np.pi / 2
+        self.angles.append(abs(np.degrees(difference)))
 
+    def summary(self):
+        if(len(self.distances) == 0):
+            return f'No frame to compare, {self.disagreements} detections disagree'
+
+        distances = np.array(self.distances)
+        angles = np.array(self.angles)
+
+        return (
+            f'Drift from the full resolution search over {len(distances)} frames:\n'
+            f'\tCentroid: mean {distances.mean():.3f}px, p95 {np.percentile(distances, 95):.3f}px, max {distances.max():.3f}px\n'
+            f'\tAngle: mean {angles.mean():.3f}deg, p95 {np.percentile(angles, 95):.3f}deg, max {angles.max():.3f}deg\n'
+            f'\tFrames detected by only one of them: {self.disagreements}'
+        )
+
+class TrackState:
+    # Sequential bookkeeping of the detections, kept apart from the vision
+    # work so chunks processed elsewhere can be stitched back in order
+
+    def __init__(self, rois, stats):
+        self.rois = rois
+        self.stats = stats
+
+        # Varibles fo tracking the mice's position
+        self.previous_pos = (0, 0)
+        self.current_pos = (0, 0)
+
+    def update(self, orientation):
+        # Without a detection the animal stays where it was last seen
+        if(orientation is not None):
+            mean = orientation[0]
+            self.current_pos = (int(mean[0]), int(mean[1]))
+
+        speed = np.sqrt(
+            (self.previous_pos[0] - self.current_pos[0])**2 + 
+            (self.previous_pos[1] - self.current_pos[1])**2
+        )
+
+        self.previous_pos = self.current_pos
+
+        # Check if the mice is inside each ROI
+        x_pos, y_pos = self.current_pos
+        inside = [
+            any(self.current_pos) and x <= x_pos <= x+w and y <= y_pos <= y+h
+            for x, y, w, h in self.rois
+        ]
+
+        self.stats.update(speed, inside)
+
+        return speed, inside
+
+def sequentialDetections(cap, segmenter, finder=None, drift=None, adaptive=None, with_contour=True):
+    timer = segmenter.timer
+
+    while(cap.isOpened()):
+        began = timer.now()
+        ret, frame = cap.read()
+
+        if(not ret):
+            return
+
+        timer.start(began)
+        timer.mark('decode')
+
+        contour, orientation, area = detect(segmenter, frame, finder, with_contour)
+
+        if(adaptive is not None):
+            # Updated in place, the segmenter already holds this background.
+            # The detection is only masked out when the whole frame was segmented
+            adaptive.update(frame, segmenter.mask if segmenter.window is None else None)
+
+            # A single channel segmenter keeps its own reduced copy
+            if(segmenter.channels != 'bgr'):
+                segmenter.set_background(adaptive.bg_img)
+
+            # And the coarse level its own downscaled copy
+            if(isinstance(finder, CoarseToFine)):
+                finder.set_background(adaptive.bg_img)
+
+            timer.mark('background')
+
+        if(drift is not None):
+            _, reference, _ = detect(segmenter, frame, with_contour=False)
+            drift.add(orientation, reference)
+            timer.mark('drift')
+
+        yield frame, contour, orientation, area
+
+def _initWorker(video, bg_img, lower_white, upper_white, segmenter_options, search_window, pyramid_scale):
+    global worker_video, worker_segmenter, worker_finder_settings
+
+    # Each process already owns a core
+    cv.setNumThreads(1)
+
+    worker_video = video
+    worker_segmenter = Segmenter(bg_img, lower_white, upper_white, **segmenter_options)
+    worker_finder_settings = (search_window, pyramid_scale)
+
+def _detectChunk(bounds):
+    start, end = bounds
+
+    cap = cv.VideoCapture(worker_video)
+    cap.set(cv.CAP_PROP_POS_FRAMES, start)
+
+    # Each chunk starts with a search over the whole frame
+    finder = makeFinder(worker_segmenter, *worker_finder_settings)
+
+    # x, y, angle and area of each frame, NaN when nothing was detected
+    results = []
+    frameIndex = start
+
+    while(end is None or frameIndex < end):
+        ret, frame = cap.read()
+
+        if(not ret):
+            break
+
+        _, orientation, area = detect(worker_segmenter, frame, finder, with_contour=False)
+
+        if(orientation is None):
+            results.append((np.nan, np.nan, np.nan, 0))
+        else:
+            mean, _, _, angle = orientation
+            results.append((mean[0], mean[1], angle, area))
+
+        frameIndex += 1
+
+    cap.release()
+
+    return np.array(results, dtype=np.float64).reshape(-1, 4)
+
+def parallelDetections(video, bg_img, lower_white, upper_white, segmenter_options, finder_settings, first_frame, num_frames, workers, timer):
+    # More chunks than workers keeps every process busy until the end
+    num_chunks = max(workers * 4, 1)
+    edges = np.linspace(first_frame, max(num_frames, first_frame), num_chunks + 1).astype(int)
+
+    # The frame count is only an estimate, the last chunk reads until the end
+    chunks = [ (int(edges[i]), int(edges[i + 1])) for i in range(num_chunks - 1) ]
+    chunks.append((int(edges[-2]), None))
+
+    with Pool(workers, initializer=_initWorker, initargs=(video, bg_img, lower_white, upper_white, segmenter_options, *finder_settings)) as pool:
+        # imap keeps the chunks in order for the sequential stitching
+        for results in pool.imap(_detectChunk, chunks):
+            # Only the time spent waiting for the workers is seen from here
+            timer.mark('workers')
+
+            for x, y, angle, area in results:
+                timer.start()
+
+                if(np.isnan(x)):
+                    yield None, None, None, 0
+                else:
+                    yield None, None, ((x, y), None, None, angle), area
+
+def trackVideo(args):
     cap = cv.VideoCapture(args.video)
     frameWidth = int(cap.get(3)) 
     frameHeight = int(cap.get(4))
 
     if (not cap.isOpened()):
         print('Error opening video stream')
-        exit()
+        return False
+
+    workers = args.workers if args.workers > 0 else cpu_count()
+
+    if(workers > 1):
+        if(args.save_video):
+            print('The annotated video can not be saved when using several workers')
+            return False
+
+        # Chunks are merged at the end, there is nothing to show meanwhile
+        args.headless = True
 
     # First frame as the background image
     ret, bg_img = cap.read()
     
     if(not ret):
         print('Error readning video stream')
-        exit()
+        return False
+
+    if(args.background == 'median'):
+        # Median of frames spread over the video, cached for later runs
+        median_bg = cachedBackground(args.video, args.bg_samples)
+
+        if(median_bg is not None):
+            bg_img = median_bg
 
     # Selection of the ROIs
     ret, frame = cap.read()
 
     if(not ret):
         print('Error readning video stream')
-        exit()
+        return False
 
-    roi_win = 'ROI Selection'
-    cv.namedWindow(roi_win, cv.WINDOW_KEEPRATIO)
-    cv.resizeWindow(roi_win, 1438, 896)
-
-    rois = cv.selectROI(roi_win, frame, False)
-    cv.destroyWindow(roi_win)
+    rois = loadRois(args, frame)
 
-    # Counter for each selected region    
-    rois_counter = [ 0 for _ in range(len(rois)) ]
-    statsLogFile = f"./logs/{args.video.split('/')[-1].split('.')[0]}_stats.txt"
+    stats = StatsAccumulator(rois, args.frame_rate, args.stats_every, args.stats_interval)
+    state = TrackState(rois, stats)
 
     if(args.save_video):
         resultFileName = f"{args.video.split('/')[-1].split('.')[0]}_result.avi"
 
-        outWriter = cv.VideoWriter(
+        # Encoding runs on its own thread
+        outWriter = AsyncVideoWriter(
             resultFileName,
             cv.VideoWriter_fourcc('M', 'J', 'P', 'G'),
-            args.frame_rate, (frameWidth, frameHeight)
+            args.frame_rate, (frameWidth, frameHeight),
+            args.writer_queue, args.writer_policy
         )
 
     # Check whether it's necessary to create a logs directory
-    if(args.log_stats or args.log_position or args.log_speed):
+    if(args.log_stats or args.log_position or args.log_speed or args.profile):
         if(not path.exists('./logs')):
             mkdir('./logs')
 
-    # Create file for stats loging
+    # Stats are kept in memory, these files only get snapshots of them
     statsLogFile = f"./logs/{args.video.split('/')[-1].split('.')[0]}_stats.txt"
-    if(args.log_stats):
-        with open(statsLogFile, 'w') as log_file:
-            log_file.write('')
+    statsJsonFile = f"./logs/{args.video.split('/')[-1].split('.')[0]}_stats.json"
 
-    # Create file for position loging
+    # Positions and speeds are buffered into a binary log and exported to
+    # CSV once the video is over
     posLogFile = f"./logs/{args.video.split('/')[-1].split('.')[0]}_pos.csv"
-    if(args.log_position):        
-        with open(posLogFile, 'w') as log_file:
-            log_file.write('x,y\n')
-
-    # Create file for speed loging 
     speedLogFile = f"./logs/{args.video.split('/')[-1].split('.')[0]}_speed.csv"
-    if(args.log_speed):        
-        with open(speedLogFile, 'w') as log_file:
-            log_file.write('time,speed\n')
+    trajectoryLogFile = f"./logs/{args.video.split('/')[-1].split('.')[0]}.trj"
+
+    profileJsonFile = f"./logs/{args.video.split('/')[-1].split('.')[0]}_profile.json"
+    profileCsvFile = f"./logs/{args.video.split('/')[-1].split('.')[0]}_profile.csv"
+
+    trajectory = None
+    if(args.log_position or args.log_speed):
+        trajectory = TrajectoryWriter(
+            trajectoryLogFile, frameWidth, frameHeight, args.frame_rate,
+            fsync_interval=args.fsync_interval
+        )
 
     result_win = 'Tracker'
-    cv.namedWindow(result_win, cv.WINDOW_KEEPRATIO)
-    cv.resizeWindow(result_win, 640, 528)
+    if(not args.headless):
+        cv.namedWindow(result_win, cv.WINDOW_KEEPRATIO)
+        cv.resizeWindow(result_win, 640, 528)
+
+    # Annotations are only drawn when someone is going to see them
+    draw = not args.headless or args.save_video
 
     # Color range of the mice un the subtracted image
-    lower_white = np.array([100, 100, 100])
-    upper_white = np.array([160, 160, 160])
+    lower_white = np.array([args.lower_boundary] * 3)
+    upper_white = np.array([args.upper_boundary] * 3)
+
+    segmenter_options = {
+        'channels': args.channels,
+        'morphology': args.morphology,
+        'detector': args.detector
+    }
+    segmenter = Segmenter(bg_img, lower_white, upper_white, **segmenter_options)
+
+    # Does nothing unless profiling
+    timer = makeTimer(args.profile)
+    segmenter.timer = timer
+
+    adaptive = None
+    if(args.adaptive_bg > 0):
+        if(workers > 1):
+            print('The adaptive background is not used with several workers')
+        else:
+            adaptive = RunningBackground(bg_img, args.adaptive_bg)
+            segmenter.set_background(adaptive.bg_img)
+
+    finder = makeFinder(segmenter, args.search_window, args.pyramid_scale)
 
-    # Varibles fo tracking the mice's position
-    previous_pos = (0, 0)
-    current_pos = (0, 0)
+    # Also searches the whole frame at full resolution to measure the difference
+    drift = None
+    if(args.report_drift and finder is not None and workers == 1):
+        drift = DriftReport()
 
     frameIndex = 0
-    traveledDistance = 0
 
     num_frames = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
-    pbar = tqdm(total=num_frames)
+    pbar = tqdm(total=num_frames, disable=args.no_progress)
 
-    while(cap.isOpened()):
-        ret, frame = cap.read()
-        pbar.update(1)
+    if(workers > 1):
+        cap.release()
 
-        if(not ret):
-            print('Error readning video stream')
-            pbar.close()
-            exit()
-
-        sub_frame = cv.absdiff(frame, bg_img)
-           
-        filtered_frame = cv.inRange(sub_frame, lower_white, upper_white)
-        
-        # Kernel for morphological operation opening
-        kernel3 = cv.getStructuringElement(
-            cv.MORPH_ELLIPSE,
-            (3, 3),
-            (-1, -1)
+        # Background and ROI frames were already consumed
+        detections = parallelDetections(
+            args.video, bg_img, lower_white, upper_white, segmenter_options,
+            (args.search_window, args.pyramid_scale),
+            2, num_frames, workers, timer
         )
+    else:
+        if(args.prefetch > 0):
+            # Decodes the next frames while the current one is processed
+            cap = FrameSource(cap, args.prefetch)
 
-        kernel20 = cv.getStructuringElement(
-            cv.MORPH_ELLIPSE,
-            (20, 20),
-            (-1, -1)
-        )
+        detections = sequentialDetections(cap, segmenter, finder, drift, adaptive, draw)
 
-        # Morphological opening
-        mask = cv.dilate(cv.erode(filtered_frame, kernel3), kernel20)
+    start_time = perf_counter()
 
-        # Find all the contours in the mask
-        returns = cv.findContours(mask, cv.RETR_LIST, cv.CHAIN_APPROX_NONE)
-        
-        # Check what findContours returned
-        contours = []
-        if(len(returns) == 3):
-            contours = returns[1]
-        else:
-            contours = returns[0]
+    for frame, contour, orientation, area in detections:
+        pbar.update(1)
+
+        speed, inside = state.update(orientation)
+        current_pos = state.current_pos
+        timer.mark('tracking')
+
+        if(draw and contour is not None):
+            _, eigenvectors, eigenvalues, _ = orientation
 
-        if(len(contours) != 0):
-            # find the biggest countour by the area
-            contour = max(contours, key = cv.contourArea)
             cv.drawContours(frame, [contour], 0, (255, 0, 255), 2)
+            drawOrientation(frame, current_pos, eigenvectors, eigenvalues, args.draw_axis)
 
-            # Find the orientation of each shape
-            current_pos, _ = getOrientation(contour, frame, args.draw_axis)
+        if(draw):
+            drawRois(frame, rois, stats.dwell_frames, inside)
 
-        speed = np.sqrt(
-            (previous_pos[0] - current_pos[0])**2 + 
-            (previous_pos[1] - current_pos[1])**2
-        )
+        if(args.color_mask and draw):
+            # Apply the mask with its own color
+            segmenter.overlay_mask(frame, (222, 70, 222))
 
-        traveledDistance += speed
-        previous_pos = current_pos
+        timer.mark('drawing')
 
-        if(args.log_speed):
-            if(current_pos[0] > 50 and current_pos[1] > 50):        
-                with open(speedLogFile, 'a') as logFile:
-                    logFile.write(f'{frameIndex * (1/float(args.frame_rate)):.3f},{speed:.3f}\n')
-        
-        # Draw ROI and check if the mice is inside 
-        if(rois is not None):
+        if(trajectory is not None):
+            # Frames are numbered as in the video, after the background and ROI frames
+            trajectory.write(
+                frameIndex + 2, frameIndex * (1/float(args.frame_rate)),
+                current_pos[0], current_pos[1],
+                orientation[3] if orientation is not None else np.nan,
+                area, speed
+            )
 
-            for index, roi in enumerate(rois):
-                x, y, w, h = roi
-                
-                if(any(current_pos)):
-                    if(x <= current_pos[0] <= x+w and y <= current_pos[1] <= y+h):
-                        cv.rectangle(
-                            frame, (x, y),
-                            (x + w, y + h),
-                            (128, 244, 66), 2
-                        )
-
-                        rois_counter[index] += 1
-                        cv.putText(
-                            frame, f'{index}: {rois_counter[index]}', (x, y - 5),
-                            cv.FONT_HERSHEY_COMPLEX,
-                            0.5, (255, 255, 255)
-                        )
-
-                    else:
-                        cv.rectangle(
-                            frame, (x, y),
-                            (x + w, y + h),
-                            (80, 80, 80), 2
-                        )
-
-                        cv.putText(
-                            frame, f'{index}: {rois_counter[index]}', (x, y - 5),
-                            cv.FONT_HERSHEY_COMPLEX,
-                            0.5, (255, 255, 255)
-                        )
-                else:
-                    cv.rectangle(
-                        frame, (x, y),
-                        (x + w, y + h),
-                        (80, 80, 80), 2
-                    )
-
-                    cv.putText(
-                        frame, f'{index}: {rois_counter[index]}', (x, y - 5),
-                        cv.FONT_HERSHEY_COMPLEX,
-                        0.5, (255, 255, 255)
-                    )
-
-            if(args.log_stats):
-                # Saves the rois counter to file
-                with open(statsLogFile, 'w') as log_file:
-                    
-                    log_file.write(f'\tCounters for the regions considering {args.frame_rate}fps video\n')
-                    log_file.write(f'\n- Traveled distance: {traveledDistance:.3f} pixels\n')
-
-                    log_file.write('\n- Time in spent in each region:\n')
-                    for idx, region in enumerate(rois_counter):
-                        log_file.write(f'\tRegion {idx}:\t{rois_counter[idx]} frames')
-                        log_file.write(f', {rois_counter[idx] * (1/float(args.frame_rate)):.3f}s\n')
-
-        # Save position to file
-        if(args.log_position):
-            with open(posLogFile, 'a') as logFile:
-                if(current_pos[0] > 50 and current_pos[1] > 50):
-                    # Changes the coordinates' center to the bottom left for later plotting
-                    logFile.write(f'{current_pos[0]},{frameHeight - current_pos[1]}\n')
-
-        if(args.color_mask):
-            # Change the color of the mask
-            colored_mask = cv.cvtColor(mask, cv.COLOR_GRAY2BGR)
-            colored_mask[np.where((colored_mask == [255, 255, 255]).all(axis = 2))] = [222, 70, 222]
-
-            # Apply the mask
-            frame = cv.add(frame, colored_mask)
+        if(args.log_stats and stats.should_flush()):
+            stats.write(statsLogFile, statsJsonFile)
+
+        timer.mark('logging')
 
-        cv.imshow(result_win, frame)
         frameIndex += 1
 
         if(args.save_video):
             outWriter.write(frame)
+            timer.mark('writing')
 
-        key = cv.waitKey(10)
-        if(key == 27 or key == 113):
-            cv.destroyAllWindows()
-            cap.release()
-            pbar.close()
+        if(timer.should_snapshot(args.profile_interval)):
+            tqdm.write(timer.snapshot())
+
+        if(args.headless):
+            continue
 
-            if(args.save_video):
-                outWriter.release()
+        cv.imshow(result_win, frame)
 
-            exit()
+        key = cv.waitKey(10)
+        if(key == 27 or key == 113):
+            break
 
         if(key == 32):
             while True:
@@ -291,12 +657,55 @@ if __name__ == '__main__':
                 key2 = cv.waitKey(5)
                 if(key2 == 32):
                     break
-                elif(key2 == 27 or key == 113):
-                    cv.destroyAllWindows()
-                    cap.release()
-                    pbar.close()
+                elif(key2 == 27 or key2 == 113):
+                    key = key2
+                    break
+
+            if(key == 27 or key == 113):
+                break
+
+        timer.mark('display')
+
+    elapsed = perf_counter() - start_time
+
+    cap.release()
+    pbar.close()
 
-                    if(args.save_video):
-                        outWriter.release()
+    if(args.save_video):
+        dropped = outWriter.release()
+
+        if(dropped > 0):
+            print(f'{dropped} frames dropped while saving the video')
+
+    if(args.log_stats):
+        # Final report
+        stats.write(statsLogFile, statsJsonFile)
+
+    if(trajectory is not None):
+        trajectory.close()
+
+        exportCsv(
+            trajectoryLogFile,
+            posLogFile if args.log_position else None,
+            speedLogFile if args.log_speed else None
+        )
 
-                    exit()
\ No newline at end of file
+    if(not args.headless):
+        cv.destroyAllWindows()
+
+    if(isinstance(finder, SearchWindow)):
+        print(f'Whole frame searched in {finder.full_searches} of {finder.frames} frames')
+
+    if(drift is not None):
+        print(drift.summary())
+
+    print(f'Processed {frameIndex} frames in {elapsed:.3f}s ({frameIndex / max(elapsed, 1e-9):.2f} fps)')
+
+    if(args.profile):
+        print(timer.snapshot())
+        timer.write(profileJsonFile, profileCsvFile)
+
+    return True
+
+if __name__ == '__main__':
+    trackVideo(parser_args())
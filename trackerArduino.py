@@ -1,6 +1,12 @@
+from segmentation import Segmenter
+from background import cachedBackground
+from frameSource import FrameSource
+from videoWriter import AsyncVideoWriter
+from profiling import makeTimer, reportAtExit
 from utils import drawAxis, getOrientation
 import numpy as np
 import cv2 as cv
+from os import makedirs
 import argparse
 import serial
 
@@ -11,10 +17,12 @@ upper_white = np.array([170, 170, 170])
 def onTrackbarLower(val):
     global lower_white
     lower_white = np.array([val, val, val])
+    segmenter.set_boundaries(lower_white, upper_white)
 
 def onTrackbarUpper(val):
     global upper_white
     upper_white = np.array([val, val, val])
+    segmenter.set_boundaries(lower_white, upper_white)
 
 def parser_args():
     parser = argparse.ArgumentParser(
@@ -27,8 +35,8 @@ def parser_args():
     )
 
     parser.add_argument(
-        'bg_image', type=str,
-        help='Path to the background image of the scene.'
+        'bg_image', type=str, nargs='?', default=None,
+        help='Path to the background image of the scene, computed from the video when omitted.'
     )
 
     parser.add_argument(
@@ -51,6 +59,26 @@ def parser_args():
         help='Logs the position of the center of mass to file.'
     )
 
+    parser.add_argument(
+        '--morphology', type=str, default='ellipse', choices=['ellipse', 'rect', 'iterated', 'distance'],
+        help='How the opening is computed, see compareMorphology.py for their cost and accuracy.'
+    )
+
+    parser.add_argument(
+        '--detector', type=str, default='contours', choices=['contours', 'components'],
+        help='Traces every contour of the mask (best on clean masks), or labels its blobs, large masks at a reduced size first, and traces only the chosen ones (best on masks cluttered with many small blobs).'
+    )
+
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='Measures the time spent in each stage and writes a report to ./logs/<video>_profile.json and .csv.'
+    )
+
+    parser.add_argument(
+        '--profile-interval', type=float, default=30.0,
+        help='Seconds between the profiling snapshots printed while running, 0 prints only the final one.'
+    )
+
     return parser.parse_args()
     
 if __name__ == '__main__':
@@ -58,12 +86,33 @@ if __name__ == '__main__':
 
     ser = serial.Serial(port='/dev/ttyUSB0', baudrate=500000)
 
-    bg_img = cv.imread(args.bg_image)
+    if(args.bg_image is not None):
+        bg_img = cv.imread(args.bg_image)
+    else:
+        # Median of frames spread over the video, cached for later runs
+        bg_img = cachedBackground(args.video)
 
-    if(bg_img.size is None):
+    if(bg_img is None):
         print('Error opening background image')
         exit()
 
+    # Blurred subtraction with a larger opening for the live setup
+    segmenter = Segmenter(
+        bg_img, lower_white, upper_white,
+        erode_size=18, dilate_size=30, blur=True,
+        morphology=args.morphology, detector=args.detector
+    )
+
+    # Does nothing unless profiling
+    timer = makeTimer(args.profile)
+    segmenter.timer = timer
+
+    if(args.profile):
+        makedirs('./logs', exist_ok=True)
+
+        profileName = './logs/' + args.video.split('/')[-1].split('.')[0] + '_profile'
+        reportAtExit(timer, profileName + '.json', profileName + '.csv')
+
     cap = cv.VideoCapture(args.video)
 
     if (not cap.isOpened()):
@@ -80,6 +129,9 @@ if __name__ == '__main__':
     roi = cv.selectROI('ROI Selection', frame, False)
     cv.destroyWindow('ROI Selection')
 
+    # Only a couple of frames ahead to keep the serial decisions close to real time
+    cap = FrameSource(cap, 2)
+
     result_win = 'Tracker'
     cv.namedWindow(result_win, cv.WINDOW_KEEPRATIO)
     cv.resizeWindow(result_win, 640, 528)
@@ -91,64 +143,45 @@ if __name__ == '__main__':
     cv.createTrackbar(trackbarUpper, result_win , 170, 255, onTrackbarUpper)
 
     if(args.save_video):
-        outWriter = cv.VideoWriter(
+        # Encoding runs on its own thread and never holds back the live loop
+        outWriter = AsyncVideoWriter(
             'result.avi',
             cv.VideoWriter_fourcc('M', 'J', 'P', 'G'),
-            50, (640, 480)
+            50, (640, 480),
+            policy='drop'
         )
     
     while(cap.isOpened()):
+        began = timer.now()
         ret, frame = cap.read()
 
         if(not ret):
             print('Error readning video stream')
-            exit()
-
-        sub_frame = cv.medianBlur(cv.GaussianBlur(cv.absdiff(frame, bg_img), (5, 5), 0), 5)
 
-        filtered_frame = cv.inRange(sub_frame, lower_white, upper_white)
-        
-        # Kernel for morphological operation opening
-        kernel1 = cv.getStructuringElement(
-            cv.MORPH_ELLIPSE,
-            (18, 18),
-            (-1, -1)
-        )
+            if(args.save_video):
+                print(f'{outWriter.release()} frames dropped while saving the video')
 
-        kernel2 = cv.getStructuringElement(
-            cv.MORPH_ELLIPSE,
-            (30, 30),
-            (-1, -1)
-        )
+            exit()
 
-        # Morphological opening
-        mask = cv.dilate(cv.erode(filtered_frame, kernel1), kernel2)
+        timer.start(began)
+        timer.mark('decode')
 
-        # Find all the contours in the mask
-        returns = cv.findContours(mask, cv.RETR_LIST, cv.CHAIN_APPROX_NONE)
-        
-        # Check what findContours returned
-        contours = []
-        if(len(returns) == 3):
-            contours = returns[1]
-        else:
-            contours = returns[0]
+        segmenter.segment(frame)
 
         cntr = (0, 0)
-        for i, c in enumerate(contours):
-            # Calculate the area of each contour
-            area = cv.contourArea(c)
-
-            # Ignore contours that are too small or too large
-            if area < 1e2 or 1e5 < area:
-                continue
+        # Ignore contours that are too small or too large
+        contours = segmenter.filtered_contours(1e2, 1e5)
+        timer.mark('detect')
 
+        for c in contours:
             # Draw each contour only for visualisation purposes
-            cv.drawContours(frame, contours, i, (255, 0, 255), 2)
+            cv.drawContours(frame, [c], 0, (255, 0, 255), 2)
 
             # Find the orientation of each shape
             cntr, _ = getOrientation(c, frame, args.draw_axis)
-        
+
+        timer.mark('orientation')
+
         # Draw ROI and check if the mice is inside 
         if(roi is not None):
             x, y, w, h = roi
@@ -186,6 +219,8 @@ if __name__ == '__main__':
 
                 ser.write(b'0')
 
+        timer.mark('serial')
+
         # Save position to file
         if(args.log_position):
             logFileName = args.video.split('/')[-1].split('.')[0] + '_log.txt'
@@ -193,26 +228,30 @@ if __name__ == '__main__':
             with open(logFileName, 'a') as logFile:
                 logFile.write(f'{cntr[0]} {cntr[1]}\n')
 
-        if(args.color_mask):
-            # Change the color of the mask
-            colored_mask = cv.cvtColor(mask, cv.COLOR_GRAY2BGR)
-            colored_mask[np.where((colored_mask == [255, 255, 255]).all(axis = 2))] = [0, 0, 255]
-
-            # Apply the mask
-            frame = cv.add(frame, colored_mask)
+            timer.mark('logging')
 
-        cv.imshow(result_win, frame)
+        if(args.color_mask):
+            # Apply the mask with its own color
+            segmenter.overlay_mask(frame, (0, 0, 255))
+            timer.mark('drawing')
 
         if(args.save_video):
             outWriter.write(frame)
+            timer.mark('writing')
+
+        if(timer.should_snapshot(args.profile_interval)):
+            print(timer.snapshot())
+
+        cv.imshow(result_win, frame)
 
         key = cv.waitKey(5)
+        timer.mark('display')
         if(key == 27 or key == 113):
             cv.destroyAllWindows()
             cap.release()
 
             if(args.save_video):
-                outWriter.release()
+                print(f'{outWriter.release()} frames dropped while saving the video')
 
             exit()
         elif(key == 32):
@@ -228,6 +267,6 @@ if __name__ == '__main__':
                     cap.release()
 
                     if(args.save_video):
-                        outWriter.release()
+                        print(f'{outWriter.release()} frames dropped while saving the video')
 
                     exit()
\ No newline at end of file
@@ -0,0 +1,193 @@
+from os import fsync, path
+from time import perf_counter
+import numpy as np
+import argparse
+import struct
+
+# Columns of each record, stored one after the other inside each chunk
+COLUMNS = (
+    ('frame', '<u4'),
+    ('time', '<f8'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('angle', '<f4'),
+    ('area', '<f4'),
+    ('speed', '<f4')
+)
+
+RECORD = np.dtype(list(COLUMNS))
+
+# Magic, version, frame width, frame height and frame rate
+HEADER = struct.Struct('<4sHIIf')
+MAGIC = b'TRJ\0'
+VERSION = 1
+
+# Number of records of the chunk that follows
+CHUNK = struct.Struct('<I')
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Exports a binary trajectory log to the CSV files used by the plotting scripts.'
+    )
+
+    parser.add_argument(
+        'log_file', type=str,
+        help='Path to the trajectory log file.'
+    )
+
+    parser.add_argument(
+        '--pos-csv', type=str, default=None,
+        help='Where the positions are written, defaults to <log>_pos.csv.'
+    )
+
+    parser.add_argument(
+        '--speed-csv', type=str, default=None,
+        help='Where the speeds are written, defaults to <log>_speed.csv.'
+    )
+
+    return parser.parse_args()
+
+class TrajectoryWriter:
+    # Keeps the records in memory and writes them in columnar chunks, so
+    # the tracking loop never touches the disk by itself
+
+    def __init__(self, file_path, frame_width, frame_height, frame_rate, chunk_size=4096, fsync_interval=5.0):
+        self.file = open(file_path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, frame_width, frame_height, frame_rate))
+
+        self.buffer = np.zeros(chunk_size, dtype=RECORD)
+        self.count = 0
+
+        # Seconds between forcing the data to the disk, None only on close
+        self.fsync_interval = fsync_interval
+        self.last_sync = perf_counter()
+
+    def write(self, frame, time, x, y, angle, area, speed):
+        self.buffer[self.count] = (frame, time, x, y, angle, area, speed)
+        self.count += 1
+
+        # Also written out once the interval passed, so a crash loses at
+        # most that many seconds however slowly the buffer fills
+        if(self.count == len(self.buffer) or self._sync_due()):
+            self.flush()
+
+    def _sync_due(self):
+        return self.fsync_interval is not None and perf_counter() - self.last_sync >= self.fsync_interval
+
+    def flush(self):
+        if(self.count == 0):
+            return
+
+        chunk = self.buffer[:self.count]
+
+        self.file.write(CHUNK.pack(self.count))
+        for name, _ in COLUMNS:
+            self.file.write(np.ascontiguousarray(chunk[name]).tobytes())
+
+        self.file.flush()
+        self.count = 0
+
+        if(self._sync_due()):
+            fsync(self.file.fileno())
+            self.last_sync = perf_counter()
+
+    def close(self):
+        self.flush()
+        fsync(self.file.fileno())
+        self.file.close()
+
+def readHeader(file):
+    magic, version, frame_width, frame_height, frame_rate = HEADER.unpack(file.read(HEADER.size))
+
+    if(magic != MAGIC or version != VERSION):
+        raise ValueError(f'{file.name} is not a trajectory log')
+
+    return {
+        'frame_width': frame_width,
+        'frame_height': frame_height,
+        'frame_rate': frame_rate
+    }
+
+def iterChunks(file_path):
+    with open(file_path, 'rb') as file:
+        readHeader(file)
+
+        while True:
+            size = file.read(CHUNK.size)
+
+            if(len(size) < CHUNK.size):
+                return
+
+            count, = CHUNK.unpack(size)
+            chunk = np.empty(count, dtype=RECORD)
+
+            for name, dtype in COLUMNS:
+                data = file.read(count * np.dtype(dtype).itemsize)
+
+                # A chunk cut short by a crash is left out
+                if(len(data) < count * np.dtype(dtype).itemsize):
+                    return
+
+                chunk[name] = np.frombuffer(data, dtype=dtype)
+
+            yield chunk
+
+def readTrajectory(file_path):
+    with open(file_path, 'rb') as file:
+        header = readHeader(file)
+
+    chunks = list(iterChunks(file_path))
+
+    if(len(chunks) == 0):
+        return header, np.empty(0, dtype=RECORD)
+
+    return header, np.concatenate(chunks)
+
+def exportCsv(file_path, pos_csv=None, speed_csv=None, min_pos=50):
+    with open(file_path, 'rb') as file:
+        header = readHeader(file)
+
+    pos_file = open(pos_csv, 'w') if pos_csv else None
+    speed_file = open(speed_csv, 'w') if speed_csv else None
+
+    if(pos_file):
+        pos_file.write('frame,x,y\n')
+
+    if(speed_file):
+        speed_file.write('time,speed\n')
+
+    for chunk in iterChunks(file_path):
+        x = chunk['x'].astype(int)
+        y = chunk['y'].astype(int)
+
+        # Positions too close to the border are left out, as the tracker always did
+        valid = (x > min_pos) & (y > min_pos)
+
+        if(pos_file):
+            # Changes the coordinates' center to the bottom left for later
+            # plotting, the frame keeps each row tied to its video frame
+            np.savetxt(
+                pos_file, np.column_stack((chunk['frame'][valid], x[valid], header['frame_height'] - y[valid])),
+                fmt='%d', delimiter=','
+            )
+
+        if(speed_file):
+            np.savetxt(
+                speed_file, np.column_stack((chunk['time'][valid], chunk['speed'][valid])),
+                fmt='%.3f', delimiter=','
+            )
+
+    for file in (pos_file, speed_file):
+        if(file):
+            file.close()
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    base_name = path.splitext(args.log_file)[0]
+
+    exportCsv(
+        args.log_file,
+        args.pos_csv or f'{base_name}_pos.csv',
+        args.speed_csv or f'{base_name}_speed.csv'
+    )
@@ -23,38 +23,118 @@ def drawAxis(img, p_, q_, colour, scale):
     p[1] = q[1] + 9 * sin(angle - pi / 4)
     cv.line(img, (int(p[0]), int(p[1])), (int(q[0]), int(q[1])), colour, 2, cv.LINE_AA)
 
-def getOrientation(pts, img, draw):
-    # Construct a buffer used by the pca analysis
-    sz = len(pts)
-    data_pts = np.empty((sz, 2), dtype=np.float64)
+def _eigen2x2(cxx, cxy, cyy):
+    # Closed-form eigen-decomposition of the symmetric 2x2 covariance
+    # [[cxx, cxy], [cxy, cyy]], works on scalars or whole arrays at once
+    half_trace = (cxx + cyy) / 2
+    disc = np.sqrt(((cxx - cyy) / 2)**2 + cxy**2)
 
-    for i in range(data_pts.shape[0]):
-        data_pts[i, 0] = pts[i, 0, 0]
-        data_pts[i, 1] = pts[i, 0, 1]
+    eigenvalues = np.stack((half_trace + disc, half_trace - disc), axis=-1)
 
-    # Perform PCA analysis
-    mean = np.empty((0))
-    mean, eigenvectors, eigenvalues = cv.PCACompute2(data_pts, mean)
+    # orientation in radians of the major axis
+    angle = 0.5 * np.arctan2(2 * cxy, cxx - cyy)
+    cos_a, sin_a = np.cos(angle), np.sin(angle)
 
-    # Store the center of the object
-    cntr = (int(mean[0, 0]), int(mean[0, 1]))
+    # One eigenvector per row, the major axis first as PCACompute2 does
+    eigenvectors = np.stack((
+        np.stack((cos_a, sin_a), axis=-1),
+        np.stack((-sin_a, cos_a), axis=-1)
+    ), axis=-2)
 
-    # Draw the principal components
-    cv.circle(img, cntr, 3, (42, 89, 247), -1)
-    p1 = (
-        cntr[0] + 0.02 * eigenvectors[0, 0] * eigenvalues[0, 0],
-        cntr[1] + 0.02 * eigenvectors[0, 1] * eigenvalues[0, 0]
+    return eigenvalues, eigenvectors, angle
+
+def _pointsOrientation(pts):
+    # Fallback for contours without area (lines and single pixels)
+    data_pts = pts.reshape(-1, 2).astype(np.float64)
+    mean = data_pts.mean(axis=0)
+    centred = data_pts - mean
+
+    cxx, cxy, cyy = (centred[:, 0]**2).mean(), (centred[:, 0] * centred[:, 1]).mean(), (centred[:, 1]**2).mean()
+
+    return mean, _eigen2x2(cxx, cxy, cyy)
+
+def computeOrientation(pts):
+    # Centroid, principal axes, eigenvalues and angle from the image moments
+    m = cv.moments(pts)
+
+    if(m['m00'] == 0):
+        mean, (eigenvalues, eigenvectors, angle) = _pointsOrientation(pts)
+        return (mean[0], mean[1]), eigenvectors, eigenvalues, float(angle)
+
+    eigenvalues, eigenvectors, angle = _eigen2x2(
+        m['mu20'] / m['m00'], m['mu11'] / m['m00'], m['mu02'] / m['m00']
+    )
+
+    return (m['m10'] / m['m00'], m['m01'] / m['m00']), eigenvectors, eigenvalues, float(angle)
+
+def computeRegionOrientation(mask, offset=(0, 0)):
+    # Same as computeOrientation from the pixels of a binary mask, without
+    # tracing its contour. offset is where the mask starts in the frame
+    m = cv.moments(mask, binaryImage=True)
+
+    if(m['m00'] == 0):
+        return None
+
+    eigenvalues, eigenvectors, angle = _eigen2x2(
+        m['mu20'] / m['m00'], m['mu11'] / m['m00'], m['mu02'] / m['m00']
     )
-    p2 = (
-        cntr[0] - 0.02 * eigenvectors[1,0] * eigenvalues[1,0],
-        cntr[1] - 0.02 * eigenvectors[1,1] * eigenvalues[1,0]
+
+    return (
+        (m['m10'] / m['m00'] + offset[0], m['m01'] / m['m00'] + offset[1]),
+        eigenvectors, eigenvalues, float(angle)
     )
 
+def computeOrientations(contours):
+    # Batch version of computeOrientation, contours may come from many frames.
+    # Returns centroids (N, 2), eigenvectors (N, 2, 2), eigenvalues (N, 2)
+    # and angles (N,) as arrays
+    moments = np.array([
+        (m['m00'], m['m10'], m['m01'], m['mu20'], m['mu11'], m['mu02'])
+        for m in map(cv.moments, contours)
+    ], dtype=np.float64).reshape(-1, 6)
+
+    m00 = moments[:, 0]
+    valid = m00 != 0
+    area = np.where(valid, m00, 1)
+
+    centroids = moments[:, 1:3] / area[:, None]
+    eigenvalues, eigenvectors, angles = _eigen2x2(
+        moments[:, 3] / area, moments[:, 4] / area, moments[:, 5] / area
+    )
+
+    # Contours without area are rare, solve them one by one
+    for i in np.flatnonzero(~valid):
+        centroids[i], (eigenvalues[i], eigenvectors[i], angles[i]) = _pointsOrientation(contours[i])
+
+    return centroids, eigenvectors, eigenvalues, angles
+
+def drawOrientation(img, cntr, eigenvectors, eigenvalues, draw):
+    cntr = (int(cntr[0]), int(cntr[1]))
+
+    # Draw the principal components
+    cv.circle(img, cntr, 3, (42, 89, 247), -1)
+
     if(draw):
+        # The filled region spreads about half as much as its boundary
+        # points, so the axis are scaled up to keep their previous length
+        p1 = (
+            cntr[0] + 0.04 * eigenvectors[0, 0] * eigenvalues[0],
+            cntr[1] + 0.04 * eigenvectors[0, 1] * eigenvalues[0]
+        )
+        p2 = (
+            cntr[0] - 0.04 * eigenvectors[1, 0] * eigenvalues[1],
+            cntr[1] - 0.04 * eigenvectors[1, 1] * eigenvalues[1]
+        )
+
         drawAxis(img, cntr, p1, (91, 249, 77), 2)
         drawAxis(img, cntr, p2, (190, 192, 91), 2)
 
-    # orientation in radians
-    angle = atan2(eigenvectors[0, 1], eigenvectors[0, 0])
+def getOrientation(pts, img, draw):
+    mean, eigenvectors, eigenvalues, angle = computeOrientation(pts)
+
+    # Store the center of the object
+    cntr = (int(mean[0]), int(mean[1]))
+
+    drawOrientation(img, cntr, eigenvectors, eigenvalues, draw)
 
     return cntr, angle
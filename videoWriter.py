@@ -0,0 +1,66 @@
+from threading import Thread
+from queue import Queue, Empty
+import numpy as np
+import cv2 as cv
+
+class AsyncVideoWriter:
+    # Encodes the result video on its own thread. Frames are copied into a
+    # bounded ring of buffers and written in the order they arrived. When
+    # the ring is full write() either waits for the encoder ('block') or
+    # leaves the frame out ('drop'), the dropped frames are counted.
+
+    def __init__(self, file_name, fourcc, fps, frame_size, queue_size=16, policy='block'):
+        if(policy not in ('block', 'drop')):
+            raise ValueError(f'Unknown policy for a full queue: {policy}')
+
+        self.writer = cv.VideoWriter(file_name, fourcc, fps, frame_size)
+        self.policy = policy
+        self.dropped = 0
+        self.written = 0
+
+        self.queue_size = queue_size
+        self.buffers = None
+
+        # Indexes of the buffers free to be copied into and waiting to be written
+        self.free = Queue()
+        self.pending = Queue()
+
+        for index in range(queue_size):
+            self.free.put(index)
+
+        self.thread = Thread(target=self._encode, daemon=True)
+        self.thread.start()
+
+    def _encode(self):
+        while True:
+            index = self.pending.get()
+
+            # Everything queued before it was already written
+            if(index is None):
+                return
+
+            self.writer.write(self.buffers[index])
+            self.written += 1
+
+            self.free.put(index)
+
+    def write(self, frame):
+        if(self.buffers is None):
+            self.buffers = [ np.empty_like(frame) for _ in range(self.queue_size) ]
+
+        try:
+            index = self.free.get(block=self.policy == 'block')
+        except Empty:
+            self.dropped += 1
+            return
+
+        np.copyto(self.buffers[index], frame)
+        self.pending.put(index)
+
+    def release(self):
+        self.pending.put(None)
+        self.thread.join()
+
+        self.writer.release()
+
+        return self.dropped